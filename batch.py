@@ -0,0 +1,332 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import contextlib
+import copy
+import io
+import json
+import os
+import time
+
+import cv2
+
+from settings import Config
+from video_processing import MCBuffer, input_backend, process_frame, seek_capture
+from minecraft_encoder import MCencoder
+from function_writer import FunctionWriter
+from encoding_cache import EncodingCache
+import instrumentation
+import pipeline
+
+
+# Frames waiting for each packed video writer of a shared decode
+WRITER_QUEUE_SIZE = 16
+
+# Example manifest
+MANIFEST_HELP = """
+manifest example:
+{
+    "base_config": "config.cfg",
+    "work_dir": "batch_work",
+    "jobs": [
+        {
+            "name": "intro_wall",
+            "video": "intro.mp4",
+            "config": {
+                "output_screen": {"x_resoulution": 64, "y_resoulution": 36},
+                "minecraft_output": {"function_name": "intro_wall"}
+            }
+        }
+    ]
+}
+"""
+
+
+
+
+def load_jobs(manifest_path):
+    """
+    Read a batch manifest
+    Return the manifest and the (name, config) of each job
+    """
+    with open(manifest_path, "r", encoding="utf8") as f:
+        manifest = json.load(f)
+
+    # The manifest paths are relative to the manifest file
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    base_config = os.path.join(manifest_dir, manifest.get("base_config", "config.cfg"))
+
+    jobs = []
+    for i, job in enumerate(manifest["jobs"]):
+        overrides = copy.deepcopy(job.get("config", {}))
+
+        if "video" in job:
+            overrides.setdefault("input_file", {})["input_video_file"] = (
+                os.path.join(manifest_dir, job["video"])
+            )
+
+        config = Config(base_config, overrides)
+        jobs.append((job.get("name", f"{i}_{config.function_name}"), config))
+
+    return manifest, jobs
+
+
+
+def shares_decode(config: Config):
+    """Check if the processed video of a job can be made by a shared decode"""
+    return (
+        not config.temporal_filter
+        and not config.temporal_segmentation
+        and input_backend(config) == "opencv"
+        and config.cache_dir == ""
+    )
+
+
+
+def source_frames(video_path, start, end, wanted, seek):
+    """
+    Decode a video once and yield the index and the BGR frame
+    of the frames in [start, end) wanted by at least one output
+    """
+    cap = cv2.VideoCapture(video_path)
+
+    if cap.isOpened() == False:
+        raise Exception("Error during video file loading")
+
+    if seek:
+        cap, position = seek_capture(cap, video_path, start)
+    else:
+        position = 0
+
+    for i in range(position, end):
+        # Only decode the wanted frames, the others are grabbed
+        if i >= start and wanted(i):
+            ret, frame = cap.read()
+        else:
+            ret, frame = cap.grab(), None
+
+        if (not ret) or (not cap.isOpened()):
+            break
+
+        if frame is not None:
+            yield i, frame
+
+    cap.release()
+
+
+
+def decode_source(video_path, source_hash, variants):
+    """
+    Decode a source video once and save the packed processed video
+    of each screen config using it
+    variants is a list of (config, packed path)
+    Run in a worker process, return the decode time
+    """
+    start_time = time.perf_counter()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        instrumentation.active.quiet = True
+
+        # Get the property of each processed video, without decoding it
+        buffers, paths = [], []
+        for config, packed_path in variants:
+            stream_config = copy.copy(config)
+            stream_config.streaming = True
+            stream_config.packed_video_path = ""
+
+            buf = MCBuffer(stream_config)
+            buf.source_hash = source_hash
+
+            if not buf.packed_matches(packed_path):
+                buffers.append(buf)
+                paths.append(packed_path)
+
+        if len(buffers) == 0:
+            return 0.0
+
+        def wanted_by(buf, i):
+            return buf.first_frame <= i < buf.video_end and i % buf.config.output_fps_scaling == 0
+
+        # Write each packed video on its own thread
+        writers = [
+            pipeline.StageThread(
+                lambda frames, buf=buf, path=path: buf.save_packed(path, frames),
+                WRITER_QUEUE_SIZE
+            )
+            for buf, path in zip(buffers, paths)
+        ]
+
+        try:
+            for i, frame in source_frames(
+                video_path,
+                min(buf.first_frame for buf in buffers),
+                max(buf.video_end for buf in buffers),
+                lambda i: any(wanted_by(buf, i) for buf in buffers),
+                all(buf.config.seek_to_start for buf in buffers)
+            ):
+                for buf, writer in zip(buffers, writers):
+                    if wanted_by(buf, i):
+                        writer.put(process_frame(frame, buf.out_res))
+
+        finally:
+            for writer in writers:
+                writer.join()
+
+    return time.perf_counter() - start_time
+
+
+
+def run_job(name, config: Config):
+    """
+    Run a job from its processed video to its function files
+    Run in a worker process, return the job summary
+    """
+    summary = {
+        "name": name,
+        "video": config.input_video_file,
+        "function": config.function_file_path,
+        "error": None
+    }
+
+    # The shared pool already runs the jobs in parallel
+    config.decode_workers = 1
+    config.emit_workers = 1
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            instrumentation.configure(config)
+
+            buf = MCBuffer(config)
+
+            if config.generate_debug_video or config.generate_pixel_update_video:
+                buf.generate_diagnostic_videos(
+                    config.generate_debug_video, config.generate_pixel_update_video
+                )
+
+            if config.generate_minecraft_fun:
+                with FunctionWriter(config) as writer:
+                    MCencoder(buf, config).save_mc_function(writer)
+                    summary["function_bytes"] = writer.written_bytes
+
+            instrumentation.active.save_report()
+
+        summary["output_frames"] = buf.output_frames
+
+    except Exception as e:
+        summary["error"] = f"{type(e).__name__}: {e}"
+
+    summary.update(instrumentation.active.report())
+    return summary
+
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a batch of video and screen config jobs on a shared process pool",
+        epilog=MANIFEST_HELP,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("manifest", help="JSON manifest of the jobs")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("-o", "--output", default="batch_summary.json", help="JSON summary file")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    manifest, jobs = load_jobs(args.manifest)
+
+    # Folder of the packed videos shared by the jobs
+    work_dir = manifest.get("work_dir", "batch_work")
+    cache = EncodingCache(work_dir)
+
+
+    # Group the jobs by source video and processed video settings,
+    # each source is decoded once for all its processed videos
+    sources = {}
+    source_hashes = {}
+    waiting_jobs = {}
+    ready_jobs = []
+
+    for name, config in jobs:
+        if not shares_decode(config):
+            ready_jobs.append((name, config))
+            continue
+
+        # Hash each source once, the jobs reuse it to check their packed video
+        video_path = os.path.abspath(config.input_video_file)
+        if video_path not in source_hashes:
+            source_hashes[video_path] = cache.source_hash(video_path)
+
+        source_hash = source_hashes[video_path]
+        config.source_hash = source_hash
+
+        config.packed_video_path = os.path.join(
+            work_dir, cache.buffer_key(source_hash, config.buffer_settings(input_backend(config))) + ".rvpk"
+        )
+
+        variants = sources.setdefault((video_path, source_hash), {})
+        variants.setdefault(config.packed_video_path, config)
+        waiting_jobs.setdefault(video_path, []).append((name, config))
+
+
+    summaries = []
+    decode_times = {}
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        # Start the shared decodes and the jobs decoding their own video
+        futures = {}
+        for (video_path, source_hash), variants in sources.items():
+            future = pool.submit(
+                decode_source,
+                video_path,
+                source_hash,
+                [(config, path) for path, config in variants.items()]
+            )
+            futures[future] = ("decode", video_path)
+
+        for name, config in ready_jobs:
+            futures[pool.submit(run_job, name, config)] = ("job", name)
+
+        # Start the jobs of each source as soon as it is decoded
+        while len(futures) > 0:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                kind, key = futures.pop(future)
+
+                if kind == "decode":
+                    try:
+                        decode_times[key] = future.result()
+                        print(f"Decoded {key}")
+                    except Exception as e:
+                        print(f"Decoding {key} failed: {e}")
+
+                    # The jobs decode the video themselves if the shared decode failed
+                    for name, config in waiting_jobs.pop(key):
+                        futures[pool.submit(run_job, name, config)] = ("job", name)
+
+                else:
+                    summary = future.result()
+                    summaries.append(summary)
+
+                    status = "failed: " + summary["error"] if summary["error"] else "done"
+                    print(f"Job {key} {status} in {summary['total_time']:.2f}s")
+
+
+    # Save the summary in the manifest order
+    order = {name: i for i, (name, _) in enumerate(jobs)}
+    summaries.sort(key=lambda summary: order[summary["name"]])
+
+    with open(args.output, "w", encoding="utf8") as f:
+        json.dump({
+            "total_time": time.perf_counter() - start_time,
+            "workers": args.workers,
+            "decode_times": decode_times,
+            "jobs": summaries
+        }, f, indent=4)
+
+    failed = sum(1 for summary in summaries if summary["error"] is not None)
+    print(f"{len(summaries) - failed}/{len(summaries)} jobs done, summary saved to {args.output}")
+
+
+
+if __name__ == "__main__":
+    main()
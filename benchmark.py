@@ -0,0 +1,308 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import cv2
+
+from settings import Config
+from video_processing import MCBuffer
+from minecraft_encoder import MCencoder
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# Benchmark grid
+RESOLUTIONS = [(16, 16), (35, 35), (64, 36), (128, 72)]
+FRAME_COUNTS = [300, 1200]
+PATTERNS = ["noise", "shape", "static"]
+
+# Synthetic video settings
+SOURCE_SCALE = 4
+SOURCE_FPS = 30
+OUTPUT_FPS_SCALING = 3
+
+# Seconds between the checks of a case process while waiting for its result
+RESULT_POLL_INTERVAL = 1.0
+
+# Config file used for each case
+CONFIG_TEMPLATE = """
+[input_file]
+input_video_file = {video}
+
+[output_files]
+generate_debug_video = False
+generate_minecraft_fun = True
+generate_pixel_update_video = False
+debug_video_path = {dir}/debug.avi
+update_map_video_path = {dir}/update_map.avi
+
+[output_screen]
+x_resoulution = {x_res}
+y_resoulution = {y_res}
+output_fps_scaling = {scaling}
+start_frame = 0
+finish_frame = -1
+
+[minecraft_output]
+functions_path = {dir}/data/bench/functions
+function_name = bench
+function_ext = .mcfunction
+
+[screen_property]
+screen_origin = 0,64,0
+next_row_offset = -4
+next_column_offset = 4
+"""
+
+
+
+
+def synthetic_frame(pattern, index, x_res, y_res, rng):
+    """Return a binary frame of the given pattern"""
+    if pattern == "noise":
+        return rng.integers(0, 2, (y_res, x_res), dtype=np.dtype("uint8"))
+
+    frame = np.zeros((y_res, x_res), np.dtype("uint8"))
+
+    if pattern == "shape":
+        # A square moving one pixel every few frames
+        size = max(2, min(x_res, y_res) // 3)
+        x = (index // 4) % max(1, x_res - size)
+        y = (index // 9) % max(1, y_res - size)
+        frame[y:y + size, x:x + size] = 1
+
+    return frame
+
+
+
+def write_synthetic_video(path, pattern, frames, x_res, y_res, seed=0):
+    """Write a synthetic binary video at SOURCE_SCALE times the screen resolution"""
+    rng = np.random.default_rng(seed)
+
+    writer = cv2.VideoWriter(
+        path,
+        cv2.VideoWriter_fourcc('M','J','P','G'),
+        SOURCE_FPS,
+        (x_res * SOURCE_SCALE, y_res * SOURCE_SCALE)
+    )
+
+    for i in range(0, frames):
+        frame = synthetic_frame(pattern, i, x_res, y_res, rng) * 255
+        frame = np.repeat(np.repeat(frame, SOURCE_SCALE, 0), SOURCE_SCALE, 1)
+        writer.write(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+
+    writer.release()
+
+
+
+def peak_rss():
+    """Return the peak resident memory of the process in bytes, None if unknown"""
+    if resource is None:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux report kilobytes, macOS bytes
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+
+def run_case(case, result_queue):
+    """
+    Run one benchmark case and put the result in the queue,
+    the error is put instead if the case fails
+    """
+    try:
+        result = measure_case(case)
+    except Exception as e:
+        result = dict(case)
+        result["error"] = f"{type(e).__name__}: {e}"
+
+    result_queue.put(result)
+
+
+
+def measure_case(case):
+    """Run one benchmark case and return the result"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        x_res, y_res = case["resolution"]
+
+        # Generate the input video
+        video_path = os.path.join(tmp_dir, "input.avi")
+        write_synthetic_video(video_path, case["pattern"], case["frames"], x_res, y_res)
+
+        os.makedirs(os.path.join(tmp_dir, "data", "bench", "functions"))
+        config_path = os.path.join(tmp_dir, "config.cfg")
+        with open(config_path, "w", encoding="utf8") as f:
+            f.write(CONFIG_TEMPLATE.format(
+                video=video_path, dir=tmp_dir,
+                x_res=x_res, y_res=y_res, scaling=OUTPUT_FPS_SCALING
+            ))
+
+        config = Config(config_path)
+        base_rss = peak_rss()
+        timings = {}
+
+        # Run the stages without the progress output
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            buf = MCBuffer(config)
+            timings["decode"] = time.perf_counter() - start
+
+            encoder = MCencoder(buf, config)
+
+            start = time.perf_counter()
+            encoder.encode()
+            timings["encode"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            encoder.save_mc_function()
+            timings["emit"] = time.perf_counter() - start
+
+        result = dict(case)
+        result.update({
+            "output_frames": buf.output_frames,
+            "items": int(len(encoder.items_buffer.items)),
+            "function_bytes": os.path.getsize(config.function_file_path),
+            "timings": timings,
+            "peak_rss": peak_rss(),
+            "base_rss": base_rss
+        })
+
+    return result
+
+
+
+def run_isolated(case):
+    """Run a case in a fresh process to get its own peak memory"""
+    result_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_case, args=(case, result_queue))
+    process.start()
+
+    # Wait for the result while the process is alive
+    result = None
+    while result is None:
+        try:
+            result = result_queue.get(timeout=RESULT_POLL_INTERVAL)
+        except queue.Empty:
+            if process.exitcode is None:
+                continue
+
+            # The result can be put right before the exit
+            try:
+                result = result_queue.get(timeout=RESULT_POLL_INTERVAL)
+            except queue.Empty:
+                result = dict(case)
+                result["error"] = f"case process exited with code {process.exitcode}"
+
+    process.join()
+
+    return result
+
+
+
+def git_commit():
+    """Return the current git commit, None outside a repository"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+
+def case_name(case):
+    """Return a short name for a case"""
+    x_res, y_res = case["resolution"]
+    return f"{case['pattern']} {x_res}x{y_res} {case['frames']}f"
+
+
+
+def compare(results, baseline_path):
+    """Print the timing ratio of each case against a previous result file"""
+    with open(baseline_path, "r", encoding="utf8") as f:
+        baseline = {case_name(r): r for r in json.load(f)["results"]}
+
+    print(f"\nCompared to {baseline_path} (new / old time)")
+    for result in results:
+        old = baseline.get(case_name(result))
+        if old is None or "error" in result or "error" in old:
+            continue
+
+        ratios = " ".join(
+            f"{stage} {result['timings'][stage] / max(old['timings'][stage], 1e-9):.2f}"
+            for stage in result["timings"] if stage in old["timings"]
+        )
+        print(f"{case_name(result):24} {ratios}")
+
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the decode, encode and emit stages on synthetic videos"
+    )
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="JSON result file")
+    parser.add_argument("-p", "--patterns", nargs="+", default=PATTERNS, choices=PATTERNS)
+    parser.add_argument(
+        "-r", "--resolutions", nargs="+", default=[f"{x}x{y}" for x, y in RESOLUTIONS],
+        help="screen resolutions as XxY"
+    )
+    parser.add_argument("-f", "--frames", nargs="+", type=int, default=FRAME_COUNTS, help="input frames")
+    parser.add_argument("-c", "--compare", help="previous JSON result file to compare with")
+    args = parser.parse_args()
+
+    results = []
+    for pattern in args.patterns:
+        for resolution in args.resolutions:
+            for frames in args.frames:
+                x_res, y_res = [int(v) for v in resolution.lower().split("x")]
+                case = {"pattern": pattern, "resolution": [x_res, y_res], "frames": frames}
+
+                result = run_isolated(case)
+                results.append(result)
+
+                if "error" in result:
+                    print(f"{case_name(case):24} failed: {result['error']}")
+                    continue
+
+                timings = " ".join(f"{k} {v:.3f}s" for k, v in result["timings"].items())
+                rss = result["peak_rss"]
+                rss = f"{rss / 2**20:.0f} MB" if rss is not None else "n/a"
+                print(f"{case_name(case):24} {timings}  peak rss {rss}")
+
+    # Save the results
+    with open(args.output, "w", encoding="utf8") as f:
+        json.dump({
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "platform": platform.platform(),
+            "results": results
+        }, f, indent=4)
+
+    print(f"Results saved to {args.output}")
+
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import numpy as np
+
+import instrumentation
+
+
+
+
+class ChangeIndex:
+    """
+    Sparse index of the pixel changes of a binary video
+    The change events (frame, pixel) are stored in CSR form by frame and by pixel,
+    the pixel index is x * y_res + y as in the ItemBuffer
+    A pixel changes on a frame if it differs from the previous frame,
+    the first frame has no change event
+    """
+    def __init__(self, first_frame, frames, event_pixels, frame_offsets) -> None:
+        """
+        Build the index from the first frame colors in pixel order,
+        the number of frames and the changed pixels of each frame in CSR form
+        """
+        self.first_frame = first_frame
+        self.frames = frames
+        self.pixels = len(first_frame)
+
+        # Events by frame, the pixels are in order for each frame
+        self.event_pixels = event_pixels
+        self.frame_offsets = frame_offsets
+
+        # Events by pixel, the frames are in order for each pixel
+        order = np.argsort(event_pixels, kind="stable")
+        frame_of_events = np.repeat(
+            np.arange(0, frames, dtype=np.int32), np.diff(frame_offsets)
+        )
+        self.event_frames = frame_of_events[order]
+
+        self.pixel_offsets = np.zeros(self.pixels + 1, np.dtype("int64"))
+        np.cumsum(np.bincount(event_pixels, minlength=self.pixels), out=self.pixel_offsets[1:])
+
+
+
+    @classmethod
+    def from_buffer(cls, video_buf):
+        """Build the index of a video buffer with a single vectorized pass"""
+        frames, y_res, x_res = video_buf.shape
+
+        # Changed pixels of each frame, in pixel index order
+        changes = (video_buf[1:] != video_buf[:-1]).transpose(0, 2, 1).reshape(frames - 1, x_res * y_res)
+        event_frames, event_pixels = np.nonzero(changes)
+
+        frame_offsets = np.zeros(frames + 1, np.dtype("int64"))
+        np.cumsum(np.bincount(event_frames + 1, minlength=frames), out=frame_offsets[1:])
+
+        return cls(
+            video_buf[0].ravel(order="F").copy(),
+            frames,
+            event_pixels.astype(np.int32),
+            frame_offsets
+        )
+
+
+
+    @classmethod
+    def from_frames(cls, frames):
+        """Build the index from a frames iterable with a single pass"""
+        frames = iter(frames)
+
+        first_frame = next(frames, None)
+
+        if first_frame is None:
+            raise Exception("No frame decoded from the input video")
+
+        first_frame = first_frame.ravel(order="F")
+        last_frame = first_frame
+
+        # The first frame has no change
+        frame_events = [np.zeros(0, np.dtype("int32"))]
+
+        for frame in frames:
+            frame = frame.ravel(order="F")
+            frame_events.append(np.flatnonzero(frame != last_frame).astype(np.int32))
+            last_frame = frame
+
+        frame_offsets = np.zeros(len(frame_events) + 1, np.dtype("int64"))
+        np.cumsum([len(x) for x in frame_events], out=frame_offsets[1:])
+
+        return cls(
+            first_frame.copy(),
+            len(frame_events),
+            np.concatenate(frame_events),
+            frame_offsets
+        )
+
+
+
+    def frame_changes(self, frame):
+        """Return the pixels changed on a frame"""
+        return self.event_pixels[self.frame_offsets[frame]:self.frame_offsets[frame + 1]]
+
+
+
+    def pixel_changes(self, pixel):
+        """Return the frames where a pixel changed"""
+        return self.event_frames[self.pixel_offsets[pixel]:self.pixel_offsets[pixel + 1]]
+
+
+
+    def changes_per_frame(self):
+        """Return the number of changed pixels of each frame"""
+        return np.diff(self.frame_offsets)
+
+
+
+    def changes_per_pixel(self):
+        """Return the number of changes of each pixel"""
+        return np.diff(self.pixel_offsets)
+
+
+
+    def sample(self, step=1, offset=0, frames=None):
+        """
+        Return the index of the video keeping one frame every step from the offset frame,
+        in the first frames of the video (the whole video by default)
+        """
+        frames = self.frames if frames is None else frames
+        sampled_frames = -(-(frames - offset) // step)
+        last_frame = offset + ((sampled_frames - 1) * step)
+
+        # Color of each pixel on the first kept frame
+        first_event = self.frame_offsets[offset + 1]
+        before = np.bincount(self.event_pixels[:first_event], minlength=self.pixels)
+        first_frame = self.first_frame ^ (before & 1).astype(np.dtype("uint8"))
+
+        # Change events after the first kept frame up to the last one, in frame order
+        last_event = self.frame_offsets[last_frame + 1]
+        event_pixels = self.event_pixels[first_event:last_event]
+        event_frames = np.repeat(
+            np.arange(offset + 1, last_frame + 1), self.changes_per_frame()[offset + 1:last_frame + 1]
+        )
+
+        # A change is seen on the next kept frame,
+        # the pixel only changes there if it changed an odd number of times
+        sampled = -(-(event_frames - offset) // step)
+        keys = (sampled * self.pixels) + event_pixels
+
+        if step > 1:
+            keys, counts = np.unique(keys, return_counts=True)
+            keys = keys[counts % 2 == 1]
+
+        frame_offsets = np.zeros(sampled_frames + 1, np.dtype("int64"))
+        np.cumsum(np.bincount(keys // self.pixels, minlength=sampled_frames), out=frame_offsets[1:])
+
+        return ChangeIndex(first_frame, sampled_frames, (keys % self.pixels).astype(np.int32), frame_offsets)
+
+
+
+    def runs(self, start=0, end=None):
+        """
+        Return the pixel index, color and length of every pixel run
+        in the frames [start, end) as np arrays, the whole video by default
+        Same output as find_runs on these frames in time proportional to the number of changes
+        """
+        # A frame range is read from the index of its frames
+        if start > 0 or (end is not None and end < self.frames):
+            return self.sample(1, start, end).runs()
+
+        runs_per_pixel = self.changes_per_pixel() + 1
+        run_offsets = np.zeros(self.pixels + 1, np.dtype("int64"))
+        np.cumsum(runs_per_pixel, out=run_offsets[1:])
+
+        # Each pixel run start on frame 0 or on a change and end on the next one
+        starts = np.insert(self.event_frames.astype(np.int64), self.pixel_offsets[:-1], 0)
+        ends = np.insert(self.event_frames.astype(np.int64), self.pixel_offsets[1:], self.frames)
+
+        run_pixels = np.repeat(np.arange(0, self.pixels), runs_per_pixel)
+
+        # The color alternate from the first frame color of the pixel
+        run_number = np.arange(0, len(starts)) - run_offsets[run_pixels]
+        colors = self.first_frame[run_pixels] ^ (run_number & 1).astype(np.dtype("uint8"))
+
+        return run_pixels, colors, ends - starts
+
+
+
+
+def build(buffer):
+    """
+    Build the change index of a processed video,
+    from the buffer in RAM or reading its frames
+    """
+    with instrumentation.stage(
+        "index", "Indexing the pixel changes", total=buffer.output_frames
+    ) as stage:
+        if buffer.video_buf is not None:
+            index = ChangeIndex.from_buffer(buffer.video_buf)
+        else:
+            index = ChangeIndex.from_frames(buffer.frames())
+
+        stage.advance(index.frames)
+        stage.add("changes", len(index.event_pixels))
+        stage.add("static_pixels", int(np.count_nonzero(index.changes_per_pixel() == 0)))
+
+    return index
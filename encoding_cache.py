@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import pickle
+
+import numpy as np
+
+
+
+
+def hash_file(path):
+    """Return the sha256 digest of a file content"""
+    file_hash = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+
+
+def hash_items(items):
+    """Return the content hash of a pixel items array"""
+    return hashlib.blake2b(items.tobytes(), digest_size=16).digest()
+
+
+
+
+class EncodingCache:
+    """
+    On disk cache of the pipeline intermediate results
+    Store the processed video buffer and the encoded items
+    keyed by the input file hash and the video processing settings,
+    and the rendered barrels keyed by the pixel items content hash
+    """
+    def __init__(self, cache_dir) -> None:
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+
+
+    def __path(self, name):
+        """Return the path of a cache file"""
+        return os.path.join(self.cache_dir, name)
+
+
+
+    def __write(self, name, write):
+        """
+        Write a cache file with the given function
+        The file is replaced only when completely written
+        """
+        tmp_path = self.__path(name + ".tmp")
+
+        with open(tmp_path, "wb") as f:
+            write(f)
+
+        os.replace(tmp_path, self.__path(name))
+
+
+
+    def source_hash(self, path):
+        """
+        Return the hash of an input file
+        The hash is computed again only if the file size or modification time changed
+        """
+        stat = os.stat(path)
+        file_id = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+        # Load the known hashes
+        try:
+            with open(self.__path("sources.json"), "r", encoding="utf8") as f:
+                sources = json.load(f)
+        except (OSError, ValueError):
+            sources = {}
+
+        if file_id not in sources:
+            sources[file_id] = hash_file(path)
+
+            self.__write(
+                "sources.json",
+                lambda f: f.write(json.dumps(sources, indent=4).encode("utf8"))
+            )
+
+        return sources[file_id]
+
+
+
+    def buffer_key(self, source_hash, settings):
+        """Return the cache key of a processed video buffer"""
+        key = json.dumps([source_hash, settings])
+        return hashlib.sha256(key.encode("utf8")).hexdigest()
+
+
+
+    def load_buffer(self, key):
+        """Return the cached video buffer, None if missing"""
+        try:
+            return np.load(self.__path(f"{key}_video.npy"))
+        except (OSError, ValueError):
+            return None
+
+
+
+    def save_buffer(self, key, video_buf):
+        """Save a video buffer in the cache"""
+        self.__write(f"{key}_video.npy", lambda f: np.save(f, video_buf))
+
+
+
+    def load_items(self, key):
+        """Return the cached items and offsets arrays, None if missing"""
+        try:
+            with np.load(self.__path(f"{key}_items.npz")) as data:
+                return data["items"], data["offsets"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+
+    def save_items(self, key, items, offsets):
+        """Save the encoded items arrays in the cache"""
+        self.__write(
+            f"{key}_items.npz",
+            lambda f: np.savez(f, items=items, offsets=offsets)
+        )
+
+
+
+    def load_barrels(self):
+        """Return the cached barrels body by items content hash"""
+        try:
+            with open(self.__path("barrels.pkl"), "rb") as f:
+                return pickle.load(f)
+        except (OSError, ValueError, pickle.UnpicklingError, EOFError):
+            return {}
+
+
+
+    def save_barrels(self, bodies):
+        """Save the barrels body of the last run"""
+        self.__write("barrels.pkl", lambda f: pickle.dump(bodies, f))
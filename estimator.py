@@ -0,0 +1,332 @@
+import numpy as np
+
+from minecraft_classes import SHULKER_HEADS, SHULKER_SLOTS, MAX_BARREL_ITEMS
+from minecraft_classes import ITEM_FRAGMENTS, SHULKER_TAIL, KILL_ITEMS_CMD
+from minecraft_classes import BARREL_HEAD_START, BARREL_HEAD_END, BARREL_TAIL
+from minecraft_encoder import ItemBuffer, split_runs, plan_segments, count_run_items
+from settings import Config
+import instrumentation
+
+
+
+# Number of pixels listed in the hotspots
+HOTSPOTS = 5
+
+# Largest fps scaling multiplier tried for the suggestion
+MAX_SCALING_MULTIPLIER = 64
+
+# Length of the command of each item by shulker slot and packed item
+ITEM_FRAGMENT_LENGTHS = np.array([
+    [len(fragment) if fragment is not None else 0 for fragment in slot_fragments]
+    for slot_fragments in ITEM_FRAGMENTS
+])
+
+
+
+
+def sampled_items(index, step=1, offset=0, frames=None):
+    """
+    Return the number of items of each pixel keeping only one output frame every step,
+    starting from offset, in the first frames of the video
+    Computed from the change index without the frames
+    """
+    sampled = index.sample(step, offset, frames)
+    run_pixels, _, lengths = sampled.runs()
+
+    return count_run_items(run_pixels, lengths, sampled.pixels)
+
+
+
+def range_items(index, start, end):
+    """Return the number of items of each pixel in the output frames [start, end)"""
+    run_pixels, _, lengths = index.runs(start, end)
+    return count_run_items(run_pixels, lengths, index.pixels)
+
+
+
+def function_bytes(items, offsets, coordinates_lengths):
+    """
+    Return the size of the barrel command of each pixel
+    from its packed items, without rendering the commands
+    """
+    pixels = len(offsets) - 1
+    items_per_pixel = np.diff(offsets)
+    item_pixels = np.repeat(np.arange(0, pixels), items_per_pixel)
+
+    # Shulker slot of each item
+    slots = (np.arange(0, len(items)) - offsets[item_pixels]) % SHULKER_SLOTS
+    item_bytes = np.bincount(
+        item_pixels, weights=ITEM_FRAGMENT_LENGTHS[slots, items], minlength=pixels
+    ).astype(np.int64)
+
+    # The last shulker is added even if empty
+    shulkers = (items_per_pixel // SHULKER_SLOTS) + 1
+
+    # The shulkers past the barrel slots only happen in a video that doesn't fit,
+    # they are counted with the last head length
+    head_lengths = [len(head) for head in SHULKER_HEADS]
+    head_lengths += [head_lengths[-1]] * max(0, int(shulkers.max(initial=1)) - len(head_lengths))
+    shulker_bytes = np.cumsum([0] + head_lengths)[shulkers] + (shulkers * len(SHULKER_TAIL))
+
+    return (
+        len(BARREL_HEAD_START) + coordinates_lengths + len(BARREL_HEAD_END)
+        + shulker_bytes + item_bytes + len(BARREL_TAIL)
+    )
+
+
+
+def coordinates_lengths(config: Config):
+    """Return the length of the barrel coordinates of each pixel, in pixel index order"""
+    lengths = []
+
+    for x in range(0, config.x_resoulution):
+        for y in range(0, config.y_resoulution):
+            if config.tiles is None:
+                coordinates = config.barrel_layout.pixel_to_ingame(x, y)
+            else:
+                # Get the screen of the pixel
+                row, column = y // config.screen_y_res, x // config.screen_x_res
+                tile = config.tiles[(row * config.tile_columns) + column]
+                coordinates = tile.layout.pixel_to_ingame(x - tile.x_start, y - tile.y_start)
+
+            lengths.append(len(coordinates.format()))
+
+    return np.array(lengths, np.dtype("int64"))
+
+
+
+def shard_bytes(command_bytes, config: Config):
+    """
+    Return the size of the commands of each function shard,
+    split the same way as the encoder
+    """
+    max_commands = config.shard_max_commands
+    max_bytes = config.shard_max_bytes
+
+    shards = []
+    current_bytes, current_commands = 0, 0
+
+    for command in command_bytes.tolist():
+        full_commands = max_commands > 0 and current_commands >= max_commands
+        full_bytes = max_bytes > 0 and current_bytes + command > max_bytes
+
+        if current_commands > 0 and (full_commands or full_bytes):
+            shards.append(current_bytes)
+            current_bytes, current_commands = 0, 0
+
+        current_bytes += command
+        current_commands += 1
+
+    shards.append(current_bytes)
+    return shards
+
+
+
+def output_files(command_bytes, config: Config):
+    """
+    Return the size, the number of files and the number of commands
+    of the function files saved from the size of the barrel command of each pixel
+    """
+    # Each tile has its own function with the commands of its pixels in pixel index order
+    if config.tiles is None:
+        parts = [(config, command_bytes)]
+    else:
+        screen = command_bytes.reshape(config.x_resoulution, config.y_resoulution)
+        parts = [
+            (
+                config.tile_config(tile),
+                screen[
+                    tile.x_start:tile.x_start + config.screen_x_res,
+                    tile.y_start:tile.y_start + config.screen_y_res
+                ].ravel()
+            )
+            for tile in config.tiles
+        ]
+
+    total_bytes, files, commands = 0, 0, 0
+
+    for part_config, part_bytes in parts:
+        if part_config.shard_max_commands == 0 and part_config.shard_max_bytes == 0:
+            total_bytes += int(part_bytes.sum()) + len(KILL_ITEMS_CMD)
+            files += 1
+            commands += len(part_bytes) + 1
+            continue
+
+        # Sharded function: the shards then a driver scheduling them
+        shards = shard_bytes(part_bytes, part_config)
+        kills = 1 if part_config.shard_dedup_kill else len(shards)
+
+        shard_ids = [
+            f"{part_config.function_namespace}:{part_config.function_name}_{i}" for i in range(0, len(shards))
+        ]
+        driver = [f"function {shard_ids[0]}\n"] + [
+            f"schedule function {shard_id} {i}t\n" for i, shard_id in enumerate(shard_ids) if i > 0
+        ]
+
+        total_bytes += sum(shards) + (kills * len(KILL_ITEMS_CMD)) + sum(len(line) for line in driver)
+        files += len(shards) + 1
+        commands += len(part_bytes) + kills + len(driver)
+
+    return total_bytes, files, commands
+
+
+
+def estimate(buffer, config: Config):
+    """
+    Estimate the barrels usage and the size of the function of a processed video
+    from the runs of its change index, without encoding the commands
+    Return the estimate as a dictionary
+    """
+    index = buffer.change_index()
+
+    # Split the video the same way as the encoder
+    if config.temporal_segmentation:
+        with instrumentation.stage(
+            "plan", "Planning the video segments", total=index.frames
+        ) as stage:
+            segments = plan_segments(index.frames, lambda start, end: range_items(index, start, end))
+            stage.advance(index.frames)
+    else:
+        segments = [(0, index.frames)]
+
+    with instrumentation.stage(
+        "estimate",
+        "Estimating the barrels usage",
+        unit="pixels",
+        total=index.pixels * len(segments)
+    ) as stage:
+        items_buffer = ItemBuffer(config)
+        lengths = coordinates_lengths(config)
+
+        item_count = 0
+        worst_items = None
+        total_bytes, files, commands = 0, 0, 0
+
+        for i, (start, end) in enumerate(segments):
+            # Get the items of every pixel
+            items_buffer.set_items(*split_runs(*index.runs(start, end)))
+
+            items, offsets = items_buffer.items, items_buffer.offsets
+            items_per_pixel = np.diff(offsets)
+
+            item_count += len(items)
+            if worst_items is None or items_per_pixel.max(initial=0) > worst_items.max(initial=0):
+                worst_items = items_per_pixel
+
+            # Get the size of the output functions,
+            # the size of the compressed structure files is not estimated
+            if config.output_format != "structure":
+                segment_config = config.segment_config(i) if config.temporal_segmentation else config
+                segment_bytes, segment_files, segment_commands = output_files(
+                    function_bytes(items, offsets, lengths), segment_config
+                )
+
+                total_bytes += segment_bytes
+                files += segment_files
+                commands += segment_commands
+
+            stage.advance(index.pixels)
+
+        # Get the pixels with the most items, in the worst segment
+        y_res = config.y_resoulution
+        hotspots = [
+            {"x": int(p // y_res), "y": int(p % y_res), "items": int(worst_items[p])}
+            for p in np.argsort(-worst_items, kind="stable")[:HOTSPOTS]
+        ]
+
+        structure = config.output_format == "structure"
+        worst = int(worst_items.max(initial=0))
+        report = {
+            "output_frames": index.frames,
+            "pixels": index.pixels,
+            "changes": int(len(index.event_pixels)),
+            "segments": len(segments),
+            "items": item_count,
+            "worst_pixel_items": worst,
+            "barrel_capacity": MAX_BARREL_ITEMS,
+            "barrel_usage": worst / MAX_BARREL_ITEMS,
+            "fits": worst <= MAX_BARREL_ITEMS,
+            "hotspots": hotspots,
+            "functions": None if structure else files,
+            "commands": None if structure else commands,
+            "function_bytes": None if structure else total_bytes,
+            "suggested_finish_frame": None,
+            "suggested_output_fps_scaling": None
+        }
+
+        if not report["fits"]:
+            report.update(suggest(index, buffer, config))
+
+    return report
+
+
+
+def suggest(index, buffer, config: Config):
+    """
+    Return the finish_frame and the output_fps_scaling
+    that make the video fit in the barrels
+    """
+    scaling = config.output_fps_scaling
+
+    def fits(items):
+        return items.max(initial=0) <= MAX_BARREL_ITEMS
+
+    # Longest part of the video from the start frame that fits
+    good, bad = 1, index.frames
+    while bad - good > 1:
+        middle = (good + bad) // 2
+
+        if fits(sampled_items(index, frames=middle)):
+            good = middle
+        else:
+            bad = middle
+
+    suggestion = {
+        "suggested_finish_frame": buffer.first_frame + ((good - 1) * scaling) + 1
+    }
+
+    # Smallest output fps that fits the whole video,
+    # the kept frames are the ones with an index multiple of the new scaling
+    first_output = buffer.first_frame // scaling
+    for multiplier in range(2, MAX_SCALING_MULTIPLIER + 1):
+        offset = (-first_output) % multiplier
+        if offset >= index.frames:
+            break
+
+        if fits(sampled_items(index, multiplier, offset)):
+            suggestion["suggested_output_fps_scaling"] = scaling * multiplier
+            break
+
+    return suggestion
+
+
+
+def print_estimate(report):
+    """Print an estimate report"""
+    print(f"Output frames: {report['output_frames']}")
+    print(f"Pixel changes: {report['changes']}")
+    if report["segments"] > 1:
+        print(f"Segments: {report['segments']}")
+
+    print(f"Items: {report['items']}")
+    print(
+        f"Worst barrel usage: {report['worst_pixel_items']} / {report['barrel_capacity']} items"
+        f" ({report['barrel_usage']:.1%}), {'fits' if report['fits'] else 'does NOT fit'}"
+    )
+
+    print("Hotspots:")
+    for hotspot in report["hotspots"]:
+        print(f"    pixel {hotspot['x']},{hotspot['y']}: {hotspot['items']} items")
+
+    if report["function_bytes"] is None:
+        print("Function size: not estimated for the structure output")
+    else:
+        print(f"Function files: {report['functions']}")
+        print(f"Commands: {report['commands']}")
+        print(f"Function size: {report['function_bytes']} bytes ({report['function_bytes'] / 2**20:.2f} MB)")
+
+    if report["suggested_finish_frame"] is not None:
+        print(f"Suggested finish_frame = {report['suggested_finish_frame']}")
+
+    if report["suggested_output_fps_scaling"] is not None:
+        print(f"Suggested output_fps_scaling = {report['suggested_output_fps_scaling']}")
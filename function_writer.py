@@ -0,0 +1,153 @@
+import gzip
+import json
+import os
+import zipfile
+
+from minecraft_classes import KILL_ITEMS_CMD
+from settings import Config
+import nbt
+
+
+
+
+# Characters of commands joined, encoded and written at once
+WRITE_CHUNK_SIZE = 1 << 20
+
+# Folder of the function files in a datapack namespace
+DATAPACK_FUNCTIONS_DIR = "functions"
+
+# Folder of the structure files in a datapack namespace
+DATAPACK_STRUCTURES_DIR = "structures"
+
+
+
+
+class FunctionWriter:
+    """
+    Write the function and structure files of a run with large buffered writes
+    The files are saved in functions_path and structures_path,
+    or in a zip datapack archive if datapack_path is set
+    """
+    def __init__(self, config: Config) -> None:
+        self.config = config
+
+        # Bytes of the written files, before the archive compression
+        self.written_bytes = 0
+
+        # Open the datapack archive and write the pack metadata
+        self.archive = None
+        self.archive_path = config.datapack_path
+
+        if self.archive_path != "":
+            self.tmp_path = self.archive_path + ".tmp"
+            self.archive = zipfile.ZipFile(self.tmp_path, "w", zipfile.ZIP_DEFLATED)
+
+            self.archive.writestr("pack.mcmeta", json.dumps({
+                "pack": {
+                    "pack_format": config.pack_format,
+                    "description": f"{config.function_namespace} screen functions"
+                }
+            }, indent=4))
+
+
+
+    def __enter__(self):
+        return self
+
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(exc_type is None)
+        return False
+
+
+
+    def __open(self, name):
+        """Open a function file for binary writing"""
+        file_name = name + self.config.function_ext
+
+        if self.archive is not None:
+            return self.archive.open(
+                f"data/{self.config.function_namespace}/{DATAPACK_FUNCTIONS_DIR}/{file_name}",
+                "w",
+                force_zip64=True
+            )
+
+        return open(os.path.join(self.config.functions_path, file_name), "wb")
+
+
+
+    def write(self, name, commands, kill=False):
+        """
+        Write the commands in the function file of the given name,
+        the commands are encoded and written in chunks of WRITE_CHUNK_SIZE characters
+        If kill is True terminate the file with the item cleanup command
+        Return the written bytes
+        """
+        written = 0
+
+        with self.__open(name) as f:
+            chunk, chunk_len = [], 0
+
+            for command in commands:
+                chunk.append(command)
+                chunk_len += len(command)
+
+                if chunk_len >= WRITE_CHUNK_SIZE:
+                    written += f.write("".join(chunk).encode("utf8"))
+                    chunk, chunk_len = [], 0
+
+            # Terminate the file with a command to kill all the entity
+            # produce by the setblock commands
+            if kill:
+                chunk.append(KILL_ITEMS_CMD)
+
+            written += f.write("".join(chunk).encode("utf8"))
+
+        self.written_bytes += written
+        return written
+
+
+
+    def write_structure(self, name, root):
+        """
+        Save a structure compound in a gzip compressed NBT file of the given name
+        Return the written bytes
+        """
+        data = gzip.compress(nbt.dumps(root))
+        file_name = name + ".nbt"
+
+        if self.archive is not None:
+            # The structure is already compressed
+            self.archive.writestr(
+                f"data/{self.config.function_namespace}/{DATAPACK_STRUCTURES_DIR}/{file_name}",
+                data,
+                zipfile.ZIP_STORED
+            )
+
+        else:
+            os.makedirs(self.config.structures_path, exist_ok=True)
+
+            with open(os.path.join(self.config.structures_path, file_name), "wb") as f:
+                f.write(data)
+
+        self.written_bytes += len(data)
+        return len(data)
+
+
+
+    def close(self, save=True):
+        """
+        Close the datapack archive
+        The archive is only moved to datapack_path if save is True
+        """
+        if self.archive is None:
+            return
+
+        self.archive.close()
+        self.archive = None
+
+        if save:
+            os.replace(self.tmp_path, self.archive_path)
+        else:
+            os.remove(self.tmp_path)
@@ -0,0 +1,208 @@
+import cProfile
+import json
+import os
+import time
+
+
+
+
+class Stage:
+    """
+    A timed pipeline stage
+    Count the processed units, print throttled progress updates
+    and optionally profile the stage with cProfile
+    """
+    def __init__(self, instrumentation, name, label, unit, total) -> None:
+        self.instrumentation = instrumentation
+        self.name = name
+        self.label = label
+        self.unit = unit
+        self.total = total
+
+        # Processed units and other counters (items, barrels, bytes...)
+        self.count = 0
+        self.counters = {}
+
+        self.start_time = None
+        self.wall_time = None
+        self.profiler = None
+        self.quiet = False
+
+        # Last progress update
+        self.last_update = 0.0
+        self.line_len = 0
+
+
+
+    def __enter__(self):
+        # The stages started by a pipeline run quietly in its threads
+        self.quiet = self.instrumentation.quiet
+
+        if not self.quiet:
+            print(f"{self.label}... ", end="", flush=True)
+        self.line_len = len(self.label) + 4
+
+        # Start the stage profiler
+        if self.instrumentation.profile_stages and not self.instrumentation.profiling:
+            self.instrumentation.profiling = True
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+        self.start_time = time.perf_counter()
+        self.last_update = self.start_time
+        return self
+
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wall_time = time.perf_counter() - self.start_time
+
+        # Save the stage profile
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.instrumentation.profiling = False
+
+            os.makedirs(self.instrumentation.profile_dir, exist_ok=True)
+            self.profiler.dump_stats(
+                os.path.join(self.instrumentation.profile_dir, f"{self.name}.prof")
+            )
+
+        self.instrumentation.stages.append(self)
+
+        if self.quiet:
+            return False
+
+        if exc_type is not None:
+            print("Failed")
+            return False
+
+        # Clear the progress line
+        if self.line_len > len(self.label) + 4:
+            print(f"\r{' ' * self.line_len}\r{self.label}... ", end="")
+
+        print("Done")
+        return False
+
+
+
+    def advance(self, count=1):
+        """Add processed units and print the progress if needed"""
+        self.count += count
+
+        if not self.instrumentation.progress or self.quiet:
+            return
+
+        now = time.perf_counter()
+        if now - self.last_update < self.instrumentation.progress_interval:
+            return
+
+        self.last_update = now
+        rate = self.count / max(now - self.start_time, 1e-9)
+
+        done = f"{self.count}/{self.total}" if self.total is not None else f"{self.count}"
+        line = f"\r{self.label}... {done} {self.unit} ({rate:.0f} {self.unit}/s)"
+
+        print(line.ljust(self.line_len + 1), end="", flush=True)
+        self.line_len = len(line)
+
+
+
+    def add(self, counter, value):
+        """Add a value to a stage counter"""
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+
+
+    def report(self):
+        """Return the stage measurements as a dictionary"""
+        counters = dict(self.counters)
+        counters[self.unit] = counters.get(self.unit, 0) + self.count
+
+        wall_time = max(self.wall_time, 1e-9)
+
+        return {
+            "name": self.name,
+            "wall_time": self.wall_time,
+            "counters": counters,
+            "rates": {f"{k}/s": v / wall_time for k, v in counters.items()}
+        }
+
+
+
+
+class Instrumentation:
+    """Collect the stages measurements of a run"""
+    def __init__(
+        self,
+        progress=False,
+        progress_interval=1.0,
+        report_path="",
+        profile_stages=False,
+        profile_dir="profiles"
+    ) -> None:
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.report_path = report_path
+
+        self.profile_stages = profile_stages
+        self.profile_dir = profile_dir
+        self.profiling = False
+
+        # Don't print the stages output
+        self.quiet = False
+
+        self.stages = []
+        self.start_time = time.perf_counter()
+
+
+
+    def stage(self, name, label, unit="frames", total=None):
+        """Return a new stage to use as a context manager"""
+        return Stage(self, name, label, unit, total)
+
+
+
+    def report(self):
+        """Return the run measurements as a dictionary"""
+        return {
+            "total_time": time.perf_counter() - self.start_time,
+            "stages": [stage.report() for stage in self.stages]
+        }
+
+
+
+    def save_report(self):
+        """Save the timing report to the configured path"""
+        if self.report_path == "":
+            return
+
+        with open(self.report_path, "w", encoding="utf8") as f:
+            json.dump(self.report(), f, indent=4)
+
+
+
+
+# Instrumentation used by the pipeline stages
+active = Instrumentation()
+
+
+
+def configure(config):
+    """Replace the active instrumentation with one from the config settings"""
+    global active
+
+    active = Instrumentation(
+        config.progress,
+        config.progress_interval,
+        config.timing_report_path,
+        config.profile_stages,
+        config.profile_dir
+    )
+
+    return active
+
+
+
+def stage(name, label, unit="frames", total=None):
+    """Return a new stage of the active instrumentation"""
+    return active.stage(name, label, unit, total)
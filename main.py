@@ -1,26 +1,61 @@
+import argparse
+
 from settings import Config
 from video_processing import MCBuffer
 from minecraft_encoder import MCencoder
+import instrumentation
+import pipeline
+import estimator
+
+
+
+def main():
+    # Parse the command line
+    parser = argparse.ArgumentParser(description="Program a Minecraft screen to play a video")
+    parser.add_argument(
+        "--estimate",
+        action="store_true",
+        help="only estimate the barrels usage and the function size, without the output files"
+    )
+    args = parser.parse_args()
+
+    # Parse the settings file
+    cfg = Config("config.cfg")
+
+    # Setup the stages timing and progress report
+    instrumentation.configure(cfg)
+
+    # Load and process the input video
+    buf = MCBuffer(cfg)
+
+    # Estimate the output from the pixel changes without encoding it
+    if args.estimate:
+        estimator.print_estimate(estimator.estimate(buf, cfg))
+        instrumentation.active.save_report()
+        return
+
+    # Create the video encoder
+    encoder = MCencoder(buf, cfg)
 
 
-# Parse the settings file
-cfg = Config("config.cfg")
+    if cfg.pipelined:
+        # Encode the video and generate the output debug files at the same time
+        pipeline.run(buf, encoder, cfg)
 
-# Load and process the input video
-buf = MCBuffer(cfg)
+    elif cfg.generate_debug_video or cfg.generate_pixel_update_video:
+        # Generate the output debug files with a single pass on the video
+        buf.generate_diagnostic_videos(cfg.generate_debug_video, cfg.generate_pixel_update_video)
 
+    # Generate the minecraft output function
+    if cfg.generate_minecraft_fun:
+        encoder.save_mc_function()
 
-# Generate the output debug files
-if cfg.generate_debug_video:
-    buf.generate_debug_video()
-if cfg.generate_pixel_update_video:
-    buf.generate_update_map_video()
 
+    # Save the timing report
+    instrumentation.active.save_report()
 
-# Create the video encoder
-encoder = MCencoder(buf, cfg)
 
-# Generate the minecraft output function
-if cfg.generate_minecraft_fun:
-    encoder.save_mc_function()
 
+# The guard is needed by the worker processes on spawn based platforms
+if __name__ == "__main__":
+    main()
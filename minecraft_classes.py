@@ -1,9 +1,15 @@
+import nbt
+
+
+
 # Portion of command to fill one slot of a shulker box
 ITEM_CMD = "{Slot:#item_slot,id:#item_Id,Count:#count}"
 # Portion of command to put a shulker in a barrel slot 
 SHULKER_CMD = "{Slot:#shulker_slot,id:white_shulker_box,Count:1,tag:{BlockEntityTag:{Items:[#shulker_item]}}}"
 # Portion of the command to place a prefilled barrel
 BARREL_CMD = "setblock #cord minecraft:barrel[facing=east]{Items:[#barrel_item]} destroy\n"
+# Command to kill the items dropped by the replaced barrels
+KILL_ITEMS_CMD = "kill @e[type=minecraft:item]"
 
 
 
@@ -11,6 +17,13 @@ BARREL_CMD = "setblock #cord minecraft:barrel[facing=east]{Items:[#barrel_item]}
 SHULKER_SLOTS = 27
 BARREL_SLOTS = 27
 
+# Maximum number of items in a slot
+ITEM_STACK_SIZE = 64
+
+# Maximum number of items of a pixel,
+# the last shulker of a barrel is always added even if empty
+MAX_BARREL_ITEMS = (SHULKER_SLOTS * BARREL_SLOTS) - 1
+
 
 # Encoding items dictionary
 ITEM_ID_DICT = {
@@ -18,6 +31,86 @@ ITEM_ID_DICT = {
     1: "white_wool"
 }
 
+# Items are packed in one byte,
+# color in the high bit and count in the low bits
+ITEM_COLOR_SHIFT = 7
+ITEM_COUNT_MASK = 0x7F
+
+
+
+# Precompiled command fragments, split once from the templates
+# The fragments of every slot but the first start with the list separator
+def _item_fragments(slot):
+    """Return the item commands of a shulker slot indexed by packed item"""
+    fragments = [None] * 256
+
+    for color, item_id in ITEM_ID_DICT.items():
+        for count in range(1, ITEM_STACK_SIZE + 1):
+            i_cmd = ITEM_CMD
+            i_cmd = i_cmd.replace("#item_slot", str(slot))
+            i_cmd = i_cmd.replace("#item_Id", item_id)
+            i_cmd = i_cmd.replace("#count", str(count))
+
+            fragments[(color << ITEM_COLOR_SHIFT) | count] = i_cmd if slot == 0 else "," + i_cmd
+
+    return fragments
+
+
+ITEM_FRAGMENTS = [_item_fragments(slot) for slot in range(0, SHULKER_SLOTS)]
+
+SHULKER_HEADS = [
+    ("" if slot == 0 else ",") + SHULKER_CMD.split("#shulker_item")[0].replace("#shulker_slot", str(slot))
+    for slot in range(0, BARREL_SLOTS)
+]
+SHULKER_TAIL = SHULKER_CMD.split("#shulker_item")[1]
+
+BARREL_HEAD, BARREL_TAIL = BARREL_CMD.split("#barrel_item")
+BARREL_HEAD_START, BARREL_HEAD_END = BARREL_HEAD.split("#cord")
+
+
+
+# Structure file output
+# Data version of the structure files (3465 : Minecraft 1.20.1),
+# the items keep the Count and tag format of the setblock commands
+STRUCTURE_DATA_VERSION = 3465
+
+# Largest structure side that a structure block can save
+STRUCTURE_MAX_SIZE = 48
+
+# Block state of the barrels in the structure palette
+BARREL_STATE = {"Name": "minecraft:barrel", "Properties": {"facing": "east", "open": "false"}}
+
+# Command to place a structure template
+PLACE_TEMPLATE_CMD = "place template #template #cord\n"
+
+
+# Precompiled NBT fragments, same content as the command fragments
+# Payload of each item compound by shulker slot and packed item
+ITEM_NBT_FRAGMENTS = [
+    [
+        None if fragment is None else nbt.payload({
+            "Slot": nbt.Byte(slot),
+            "id": "minecraft:" + ITEM_ID_DICT[item >> ITEM_COLOR_SHIFT],
+            "Count": nbt.Byte(item & ITEM_COUNT_MASK)
+        })
+        for item, fragment in enumerate(slot_fragments)
+    ]
+    for slot, slot_fragments in enumerate(ITEM_FRAGMENTS)
+]
+
+# Shulker compound up to its items list, the list head and the items follow
+SHULKER_NBT_HEADS = [
+    nbt.named("Slot", nbt.Byte(slot))
+    + nbt.named("id", "minecraft:white_shulker_box")
+    + nbt.named("Count", nbt.Byte(1))
+    + bytes([nbt.TAG_COMPOUND]) + nbt.string_payload("tag")
+    + bytes([nbt.TAG_COMPOUND]) + nbt.string_payload("BlockEntityTag")
+    + bytes([nbt.TAG_LIST]) + nbt.string_payload("Items")
+    for slot in range(0, BARREL_SLOTS)
+]
+# End of the BlockEntityTag, tag and shulker compounds
+SHULKER_NBT_TAIL = bytes([nbt.TAG_END] * 3)
+
 
 
 
@@ -65,108 +158,88 @@ class BarrelLayour:
 
 
 
-class Shulker:
-    """A minecraft shulker object"""
-    def __init__(self) -> None:
-        # List of command for the items in each slot
-        self.items_cmds = [None] * SHULKER_SLOTS
-
-
-
-    def fill_slot(self, slot, color, amount):
-        """
-        Fill a slot with the right amount of black or white wool
-        Color is either 0 or 1
-        """
-        # Get the item id from the dictionary
-        item_id = ITEM_ID_DICT[color]
+class ScreenTile:
+    """A screen of a tiled display and its part of the video"""
+    def __init__(self, row, column, x_start, y_start, layout: BarrelLayour) -> None:
+        # Position of the screen in the grid
+        self.row = row
+        self.column = column
 
-        # Generate the items command
-        i_cmd = ITEM_CMD
+        # First video pixel shown by the screen
+        self.x_start = x_start
+        self.y_start = y_start
 
-        i_cmd = i_cmd.replace("#item_slot", str(slot))
-        i_cmd = i_cmd.replace("#item_Id", item_id)
-        i_cmd = i_cmd.replace("#count", str(amount))
+        # Barrels layout of the screen
+        self.layout = layout
 
-        # Fill the slot with the command
-        self.items_cmds[slot] = i_cmd
 
 
 
-    def return_shulker(self, barrel_slot):
-        """
-        Return the command to create a shulker in a specific barrel slot
-        """
+def barrel_body(items):
+    """
+    Return the command to place a barrel filled with the given packed items,
+    without the command start and the barrel coordinates
+    Same output as filling the BARREL_CMD, SHULKER_CMD and ITEM_CMD templates,
+    built with a single join
+    """
+    # Check for overflow of the barrel
+    if len(items) > MAX_BARREL_ITEMS:
+        raise Exception("The video can't fit in screen memory")
 
-        cmds = []
-        output = SHULKER_CMD
+    parts = [BARREL_HEAD_END]
 
-        # If the slot is empy remove it from the output
-        for i in self.items_cmds:
-            if i is not None:
-                cmds.append(i)
+    # Add a shulker for each full set of slots, the last one can be empty
+    for b_slot, start in enumerate(range(0, len(items) + 1, SHULKER_SLOTS)):
+        parts.append(SHULKER_HEADS[b_slot])
 
-        # Concatenate all the itmes commands
-        items = ",".join(cmds)
+        for s_slot, item in enumerate(items[start:start + SHULKER_SLOTS]):
+            parts.append(ITEM_FRAGMENTS[s_slot][item])
 
-        # Create the final command
-        output = output.replace("#shulker_slot", str(barrel_slot))
-        output = output.replace("#shulker_item", items)
+        parts.append(SHULKER_TAIL)
 
-        # Return the composed command
-        return output
+    parts.append(BARREL_TAIL)
 
+    # Return the composed command
+    return "".join(parts)
 
 
 
-class Barrel:
-    """A minecraft barrel object"""
-    def __init__(self, x, y, layout: BarrelLayour) -> None:
-        """
-        Create a Minecraft barrel object to store the shulker box.
-        Take the pixel coordinates as an input 
-        and calculate the in-game position of the barrel 
-        """
-        # Get the barrel coordinates
-        self.coordinates = layout.pixel_to_ingame(x, y)
+def place_barrel_body(coordinates: Coordinates, body):
+    """Return the command to place a barrel from a prerendered barrel body"""
+    return BARREL_HEAD_START + coordinates.format() + body
 
-        # List of command for the shulker in each slot
-        self.items_cmds = [None] * BARREL_SLOTS
 
 
+def barrel_command(coordinates: Coordinates, items):
+    """Return the command to place a barrel filled with the given packed items"""
+    return place_barrel_body(coordinates, barrel_body(items))
 
-    def fill_slot(self, slot, shulker: Shulker):
-        """
-        Fill a slot with the right amount of black or white wool
-        Color is either 0 or 1
-        """
-        # Generate the shulker command
-        shulker_cmd = shulker.return_shulker(slot)
 
-        # Fill the slot with the command
-        self.items_cmds[slot] = shulker_cmd
 
+def barrel_items_nbt(items):
+    """
+    Return the Items list of a barrel filled with the given packed items as a raw NBT value
+    Same content as barrel_body, built from the precompiled NBT fragments
+    """
+    # Check for overflow of the barrel
+    if len(items) > MAX_BARREL_ITEMS:
+        raise Exception("The video can't fit in screen memory")
 
+    # Add a shulker for each full set of slots, the last one can be empty
+    shulker_starts = range(0, len(items) + 1, SHULKER_SLOTS)
+    parts = [nbt.list_head(nbt.TAG_COMPOUND, len(shulker_starts))]
 
-    def return_barrel(self):
-        """
-        Return the command to place the barrel
-        """
-        cmds = []
-        output = BARREL_CMD
+    for b_slot, start in enumerate(shulker_starts):
+        shulker_items = items[start:start + SHULKER_SLOTS]
 
-        # If the slot is empy remove it from the output
-        for i in self.items_cmds:
-            if i is not None:
-                cmds.append(i)
+        parts.append(SHULKER_NBT_HEADS[b_slot])
+        parts.append(nbt.list_head(
+            nbt.TAG_COMPOUND if len(shulker_items) > 0 else nbt.TAG_END, len(shulker_items)
+        ))
 
-        # Concatenate all the itmes commands
-        items = ",".join(cmds)
+        for s_slot, item in enumerate(shulker_items):
+            parts.append(ITEM_NBT_FRAGMENTS[s_slot][item])
 
-        # Create the final command
-        output = output.replace("#cord", self.coordinates.format())
-        output = output.replace("#barrel_item", items)
+        parts.append(SHULKER_NBT_TAIL)
 
-        # Return the composed command
-        return output
-        
\ No newline at end of file
+    return nbt.Raw(nbt.TAG_LIST, b"".join(parts))
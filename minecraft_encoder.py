@@ -1,41 +1,488 @@
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import io
+
 import numpy as np
 
-from video_processing import MCBuffer
-from minecraft_classes import Barrel, Shulker, SHULKER_SLOTS, BARREL_SLOTS
+from video_processing import MCBuffer, BufferView
+from minecraft_classes import BarrelLayour, Coordinates, barrel_body, place_barrel_body, barrel_items_nbt
+from minecraft_classes import ITEM_STACK_SIZE, ITEM_COLOR_SHIFT, MAX_BARREL_ITEMS
+from minecraft_classes import STRUCTURE_DATA_VERSION, STRUCTURE_MAX_SIZE, BARREL_STATE, PLACE_TEMPLATE_CMD
 from settings import Config
+from encoding_cache import hash_items
+from function_writer import FunctionWriter
+import instrumentation
+import nbt
+import pipeline
+
+
+
+# The barrels of the pixels with at most this many runs
+# are rendered once for each items signature and reused
+REUSE_MAX_RUNS = 4
+
+
+
+
+def find_runs(video_buf):
+    """
+    Vectorized search of the pixel runs of a whole video buffer
+    Return the pixel index, color and length of every run as np arrays,
+    the pixel index is x * y_res + y and the runs of a pixel are in frame order
+    """
+    frames, y_res, x_res = video_buf.shape
+
+    # One row for each pixel with the pixel values in frame order
+    pixels = np.ascontiguousarray(video_buf.transpose(2, 1, 0)).reshape(-1, frames)
+
+    # A run start on the first frame and on every pixel update
+    starts_map = np.ones(pixels.shape, np.dtype("bool"))
+    np.not_equal(pixels[:, 1:], pixels[:, :-1], out=starts_map[:, 1:])
+
+    # Get the start, length, color and pixel of every run
+    starts = np.flatnonzero(starts_map)
+    lengths = np.diff(np.append(starts, pixels.size))
+    colors = pixels.reshape(-1)[starts]
+    run_pixels = starts // frames
+
+    return run_pixels, colors, lengths
+
+
+
+def encode_runs(video_buf):
+    """
+    Vectorized run length encoding of a whole video buffer
+    Each pixel run is split in items of at most ITEM_STACK_SIZE frames
+    Return the pixel index, color and count of every item as np arrays,
+    the pixel index is x * y_res + y and the items of a pixel are in frame order
+    """
+    return split_runs(*find_runs(video_buf))
+
+
+
+def split_runs(run_pixels, colors, lengths):
+    """
+    Split the pixel runs in items of at most ITEM_STACK_SIZE frames
+    Return the pixel index, color and count of every item as np arrays
+    """
+    # Split the runs at the stack size
+    # all the items are full stacks except the last of each run
+    items_per_run = (lengths + ITEM_STACK_SIZE - 1) // ITEM_STACK_SIZE
+
+    item_pixels = np.repeat(run_pixels, items_per_run)
+    item_colors = np.repeat(colors, items_per_run)
+
+    item_counts = np.full(len(item_pixels), ITEM_STACK_SIZE, np.dtype("uint8"))
+    last_items = np.cumsum(items_per_run) - 1
+    item_counts[last_items] = lengths - (ITEM_STACK_SIZE * (items_per_run - 1))
+
+    return item_pixels, item_colors, item_counts
+
+
+
+def count_run_items(run_pixels, lengths, pixels):
+    """
+    Return the number of items of each pixel from the length of its runs,
+    without building them
+    """
+    items_per_run = (lengths + ITEM_STACK_SIZE - 1) // ITEM_STACK_SIZE
+    return np.bincount(run_pixels, weights=items_per_run, minlength=pixels).astype(np.int64)
+
+
+
+def count_pixel_items(video_buf):
+    """
+    Return the number of items of each pixel without building them,
+    in the ItemBuffer pixel order
+    """
+    frames, y_res, x_res = video_buf.shape
+    run_pixels, _, lengths = find_runs(video_buf)
+
+    return count_run_items(run_pixels, lengths, x_res * y_res)
+
+
+
+def count_chunk_items(chunks):
+    """
+    Return the number of items of each pixel of a video read in consecutive chunks of frames,
+    same result as count_pixel_items on the whole video with a bounded memory
+    """
+    items = None
+
+    for chunk in chunks:
+        frames, y_res, x_res = chunk.shape
+        pixels = x_res * y_res
+
+        # Start with no open run on the first chunk
+        if items is None:
+            items = np.zeros(pixels, np.dtype("int64"))
+            open_runs = np.zeros(pixels, np.dtype("int64"))
+            last_frame = chunk[0]
+
+        # Search the runs from the previous frame to continue the open runs
+        run_pixels, _, lengths = find_runs(np.concatenate([last_frame[np.newaxis], chunk]))
+
+        runs_per_pixel = np.bincount(run_pixels, minlength=pixels)
+        last_runs = np.cumsum(runs_per_pixel) - 1
+        first_runs = last_runs - runs_per_pixel + 1
+
+        # The first run of each pixel continue its open run, without the previous frame
+        lengths[first_runs] += open_runs - 1
+
+        # Count the items of the closed runs, the last run of each pixel stays open
+        closed = np.ones(len(lengths), np.dtype("bool"))
+        closed[last_runs] = False
+
+        items += count_run_items(run_pixels[closed], lengths[closed], pixels)
+
+        open_runs = lengths[last_runs]
+        last_frame = chunk[-1]
+
+    # Close the last runs
+    return items + ((open_runs + ITEM_STACK_SIZE - 1) // ITEM_STACK_SIZE)
+
+
+
+def plan_segments(frames, count_items, max_items=MAX_BARREL_ITEMS):
+    """
+    Split a video of the given number of frames in the longest consecutive frame ranges
+    where every pixel fits in a barrel
+    count_items(start, end) return the number of items of each pixel of a frame range
+    Return the list of (start, end) output frame ranges
+    """
+    def fits(start, end):
+        return count_items(start, end).max() <= max_items
+
+    segments = []
+    start = 0
+    step = ITEM_STACK_SIZE
+
+    while start < frames:
+        # A single frame always fit, grow the segment exponentially
+        good, bad = start + 1, None
+        while good < frames:
+            end = min(frames, good + step)
+
+            if fits(start, end):
+                good = end
+                step *= 2
+            else:
+                bad = end
+                break
+
+        # Binary search of the segment end between the fitting and the too long one
+        if bad is not None:
+            while bad - good > 1:
+                middle = (good + bad) // 2
+
+                if fits(start, middle):
+                    good = middle
+                else:
+                    bad = middle
+
+        segments.append((start, good))
+
+        # Start the next search from the last segment length
+        step = max(1, good - start)
+        start = good
+
+    return segments
+
+
+
+
+def count_pixel_runs(items, offsets):
+    """
+    Return the number of runs of each pixel from its packed items
+    items and offsets are ItemBuffer arrays
+    """
+    starts = offsets[:-1] - offsets[0]
+    ends = offsets[1:] - offsets[0]
+
+    # A run starts on each color change and on the first item of each pixel
+    colors = items >> ITEM_COLOR_SHIFT
+    new_run = np.ones(len(items), np.dtype("bool"))
+    new_run[1:] = colors[1:] != colors[:-1]
+    new_run[starts[starts < len(items)]] = True
+
+    run_starts = np.zeros(len(items) + 1, np.dtype("int64"))
+    np.cumsum(new_run, out=run_starts[1:])
+
+    return run_starts[ends] - run_starts[starts]
+
+
+
+def render_barrels(items, offsets, layout: BarrelLayour, x_range, y_res, bodies=None):
+    """
+    Render the barrel commands of a block of screen columns
+    items and offsets are the ItemBuffer arrays of the block pixels
+    The static and low change pixels share their barrel body through bodies,
+    a dictionary of the rendered bodies by items signature
+    Return the list of commands in x then y order
+    """
+    if bodies is None:
+        bodies = {}
+
+    # Find the pixels to render from the shared bodies
+    reuse = (count_pixel_runs(items, offsets) <= REUSE_MAX_RUNS).tolist()
+
+    # The items bytes are both the items list and the signature of a pixel
+    items = items.tobytes()
+    offsets = (offsets - offsets[0]).tolist()
+
+    commands = []
+    index = 0
+
+    for x in range(x_range[0], x_range[1]):
+        for y in range(0, y_res):
+            pixel_items = items[offsets[index]:offsets[index + 1]]
+
+            if reuse[index]:
+                body = bodies.get(pixel_items)
+                if body is None:
+                    body = bodies[pixel_items] = barrel_body(pixel_items)
+            else:
+                body = barrel_body(pixel_items)
+
+            commands.append(place_barrel_body(layout.pixel_to_ingame(x, y), body))
+            index += 1
+
+    return commands
+
+
+
+
+def render_structures(items, offsets, layout: BarrelLayour, x_res, y_res):
+    """
+    Build the structures holding the barrels of the whole screen
+    items and offsets are the ItemBuffer arrays of the screen pixels
+    The barrels are grouped in cubes of at most STRUCTURE_MAX_SIZE blocks a side
+    Return the origin Coordinates and the structure compound of each cube
+    """
+    # Find the pixels to render from the shared barrel items
+    reuse = (count_pixel_runs(items, offsets) <= REUSE_MAX_RUNS).tolist()
+
+    items = items.tobytes()
+    offsets = (offsets - offsets[0]).tolist()
+
+    # Get the position and the items of every barrel
+    barrels = []
+    bodies = {}
+    index = 0
+
+    for x in range(0, x_res):
+        for y in range(0, y_res):
+            pixel_items = items[offsets[index]:offsets[index + 1]]
+
+            if reuse[index]:
+                body = bodies.get(pixel_items)
+                if body is None:
+                    body = bodies[pixel_items] = barrel_items_nbt(pixel_items)
+            else:
+                body = barrel_items_nbt(pixel_items)
+
+            coordinates = layout.pixel_to_ingame(x, y)
+            barrels.append(((coordinates.X, coordinates.Y, coordinates.Z), body))
+            index += 1
+
+    # Split the screen bounding box in cubes
+    low = [min(position[axis] for position, _ in barrels) for axis in range(0, 3)]
+
+    cubes = {}
+    for position, body in barrels:
+        cube = tuple((position[axis] - low[axis]) // STRUCTURE_MAX_SIZE for axis in range(0, 3))
+        cubes.setdefault(cube, []).append((position, body))
+
+    # Build a structure with the bounding box of each cube barrels
+    structures = []
+    for cube in sorted(cubes):
+        cube_barrels = cubes[cube]
+
+        origin = [min(position[axis] for position, _ in cube_barrels) for axis in range(0, 3)]
+        size = [
+            max(position[axis] for position, _ in cube_barrels) - origin[axis] + 1
+            for axis in range(0, 3)
+        ]
+
+        blocks = [
+            {
+                "state": nbt.Int(0),
+                "pos": [nbt.Int(position[axis] - origin[axis]) for axis in range(0, 3)],
+                "nbt": {"id": "minecraft:barrel", "Items": body}
+            }
+            for position, body in cube_barrels
+        ]
+
+        structures.append((Coordinates(*origin), {
+            "DataVersion": nbt.Int(STRUCTURE_DATA_VERSION),
+            "size": [nbt.Int(x) for x in size],
+            "palette": [BARREL_STATE],
+            "blocks": blocks,
+            "entities": []
+        }))
+
+    return structures
+
+
+
+def save_tile_function(tile_config, tile_buf, writer=None, encoder=None):
+    """
+    Encode a tile of a tiled display and save its function,
+    the encoder of the tile can be given if already encoded
+    Run in a worker process without writer, return the written bytes
+    """
+    if encoder is None:
+        encoder = MCencoder(tile_buf, tile_config)
+
+    # Keep the worker stages output out of the main progress
+    with contextlib.redirect_stdout(io.StringIO()):
+        encoder.save_mc_function(writer)
+
+    return encoder.written_bytes
+
+
+
+
+class RunTracker:
+    """
+    Streaming version of encode_runs
+    Track the pixel runs one frame at the time and produce the same items
+    """
+    def __init__(self, first_frame) -> None:
+        # Store the previous frame, flattened in pixel index order
+        self.last_frame = first_frame.ravel(order="F")
+
+        # Used to count the number of frame from the last pixel update
+        self.counter = np.zeros(self.last_frame.shape, np.dtype("uint8"))
+
+        # Items produced by each frame
+        self.__pixels = []
+        self.__colors = []
+        self.__counts = []
+
+
+
+    def __emit(self, pixels):
+        """Save the items of the given pixels and reset their counters"""
+        self.__pixels.append(pixels)
+        self.__colors.append(self.last_frame[pixels])
+        self.__counts.append(self.counter[pixels])
+
+        # Reset the counter
+        self.counter[pixels] = 0
+
+
+
+    def push(self, frame):
+        """Process the next frame"""
+        frame = frame.ravel(order="F")
+
+        # Increment the counter
+        self.counter += 1
+
+        # Get the indices of the updated pixel
+        # or the pixel that stayed unupdated for a full stack of frames
+        self.__emit(np.flatnonzero(
+            np.logical_or(frame != self.last_frame, self.counter >= ITEM_STACK_SIZE)
+        ))
+
+        # Update last frame
+        self.last_frame = frame
+
+
+
+    def finish(self):
+        """
+        Close the runs of all the pixels
+        Return the items as encode_runs does
+        """
+        # Process the last frame
+        self.counter += 1
+        self.__emit(np.arange(0, len(self.last_frame)))
+
+        # Sort the items by pixel, keeping the frame order
+        pixels = np.concatenate(self.__pixels)
+        order = np.argsort(pixels, kind="stable")
+
+        return (
+            pixels[order],
+            np.concatenate(self.__colors)[order],
+            np.concatenate(self.__counts)[order]
+        )
 
 
 
 
 class ItemBuffer:
-    """Store the encoded items list"""
+    """
+    Store the encoded items list
+    The items of all the pixels are stored in one flat array
+    with an offset index for each pixel (CSR layout),
+    an item is one byte with the color in the high bit and the count in the low bits
+    """
     def __init__(self, config: Config) -> None:
         # Get the screen resolution
         self.x_res = config.x_resoulution
         self.y_res = config.y_resoulution
 
         # Generate the internal buffer
-        self.__buffer = [[] for _ in range(0, self.x_res * self.y_res)]
+        self.items = np.zeros(0, np.dtype("uint8"))
+        self.offsets = np.zeros(self.x_res * self.y_res + 1, np.dtype("int64"))
 
 
 
-    def append_item(self, index, color, count):
-        """Save an item in the buffer"""
-        # Calculate index
-        index = index[1] + (index[0] * self.y_res)
+    def pixel_index(self, x, y):
+        """
+        Return the index of a pixel in the buffer
+        The pixels are stored column by column, in the function output order
+        """
+        return y + (x * self.y_res)
 
-        # Append item to the pixel list
-        self.__buffer[index].append((color, count))
+
+
+    def set_items(self, pixels, colors, counts):
+        """
+        Save the items of all the pixels in the buffer
+        The items must be sorted by pixel index and in frame order
+        """
+        # Pack the items
+        self.items = np.left_shift(colors, ITEM_COLOR_SHIFT, dtype=np.dtype("uint8"))
+        self.items |= counts
+
+        # Calculate the offset of each pixel list
+        items_per_pixel = np.bincount(pixels, minlength=self.x_res * self.y_res)
+        np.cumsum(items_per_pixel, out=self.offsets[1:])
 
 
 
     def get_pixel_list(self, x, y):
-        """Return the list of items for a given pixel"""
+        """
+        Return the items of a given pixel
+        The returned array is a view of the buffer
+        """
         # Calculate index
-        index = x + (y * self.y_res)
+        index = self.pixel_index(x, y)
 
         # Return the list
-        return self.__buffer[index]
+        return self.items[self.offsets[index]:self.offsets[index + 1]]
+
+
+
+    def set_arrays(self, items, offsets):
+        """Replace the buffer arrays with previously encoded ones"""
+        self.items = items
+        self.offsets = offsets
+
+
+
+    def get_columns(self, x_start, x_end):
+        """
+        Return the items and offsets of a block of columns
+        The returned arrays are views of the buffer
+        """
+        offsets = self.offsets[x_start * self.y_res:(x_end * self.y_res) + 1]
+
+        return self.items[offsets[0]:offsets[-1]], offsets
 
 
 
@@ -43,151 +490,489 @@ class ItemBuffer:
 class MCencoder:
     """Encode the video for the minecraft sceen"""
     def __init__(self, video_buf: MCBuffer, config: Config) -> None:
-        # Get the buffer and property
-        self.video_buffer = video_buf.video_buf
-        self.video_frames = video_buf.output_frames
+        # Get the video buffer
+        self.video_buffer = video_buf
 
         # Store the settings
         self.config = config
 
         # Create the items list array
         self.items_buffer = ItemBuffer(config)
+        self.encoded = False
+
+        # Bytes written by save_mc_function
+        self.written_bytes = 0
 
 
 
-    def __encode_to_items(self):
+    def __encode_to_items(self, stage, cached_items, index, frames):
         """
         Transform the video into a list of items that will later be used to fill the data shulker
         """
-        # Used to count the number of frame from the last pixel update
-        counter_matrix = np.zeros(
-            (self.config.y_resoulution, self.config.x_resoulution),
-            np.dtype("uint8")
-        )
-        # Matrix for incrementing the counters
-        inc_matrix = np.ones(
-            (self.config.y_resoulution, self.config.x_resoulution),
-            np.dtype("uint8")
-        )
+        cache = self.video_buffer.cache
+        cache_key = self.video_buffer.cache_key
 
-        # Store the previous frame in the loop
-        last_frame = self.video_buffer[0]
+        # Use the items from the cache if available
+        if cached_items is not None:
+            self.items_buffer.set_arrays(*cached_items)
+            return
 
+        if index is not None:
+            # Split the runs between the indexed pixel changes
+            items = split_runs(*index.runs())
+            stage.advance(index.frames)
 
-        # Loop through all frames
-        for i in range(1, self.video_frames):
-            # Get the new frame and check for updates
-            frame = self.video_buffer[i]
-            update_map = frame != last_frame
+        else:
+            # Encode the given frames one by one
+            frames = iter(frames)
+            first_frame = next(frames, None)
 
-            # Increment the counter
-            counter_matrix += inc_matrix
+            if first_frame is None:
+                raise Exception("No frame decoded from the input video")
 
+            tracker = RunTracker(first_frame)
+            stage.advance()
 
-            # Get the indices of the updated pixel
-            # or the pixel that stayed unupdated for more that 64 frame
-            indices_outer, indices_inner = np.where(
-                np.logical_or(update_map, counter_matrix >= 64)
-            )
+            for frame in frames:
+                tracker.push(frame)
+                stage.advance()
 
-            # Process the indices
-            for i, indices_outer in enumerate(indices_outer):
-                # Get the index
-                index = (indices_outer, indices_inner[i])
+            items = tracker.finish()
 
-                # Append item to pixel list
-                self.items_buffer.append_item(
-                    index,
-                    last_frame[index],
-                    counter_matrix[index]
-                )
+        # Save the items in the buffer
+        self.items_buffer.set_items(*items)
 
-                # Reset the counter
-                counter_matrix[index] = 0
+        # Save the items in the cache
+        if cache is not None:
+            cache.save_items(cache_key, self.items_buffer.items, self.items_buffer.offsets)
 
 
-            # Update last frame
-            last_frame = frame
 
+    def encode(self, frames=None):
+        """
+        Generate the items buffer
+        The frames are read from the video buffer if no frames iterable is given
+        """
+        # Load the items from the cache if available
+        cached_items = None
+        if self.video_buffer.cache is not None:
+            cached_items = self.video_buffer.cache.load_items(self.video_buffer.cache_key)
 
-        # Process the last frame
-        # Increment the counter
-        counter_matrix += inc_matrix
-
-        # Save items for all of the pixel
-        for x in range(0, self.config.x_resoulution):
-            for y in range(0, self.config.y_resoulution):
-                # Get the index
-                index = (y, x)
-
-                # Append item to pixel list
-                self.items_buffer.append_item(
-                    index,
-                    last_frame[index],
-                    counter_matrix[index]
-                )
+        # Get the pixel changes of the video in RAM, shared with the debug videos
+        # Without the video in RAM the frames are encoded one by one to keep the memory bounded
+        index = None
+        if cached_items is None and frames is None:
+            if self.video_buffer.video_buf is not None:
+                index = self.video_buffer.change_index()
+            else:
+                frames = self.video_buffer.frames()
 
+        with instrumentation.stage(
+            "encode", "Encoding video to items", total=self.video_buffer.output_frames
+        ) as stage:
+            self.__encode_to_items(stage, cached_items, index, frames)
+            stage.add("items", len(self.items_buffer.items))
 
+        self.encoded = True
 
-    def save_mc_function(self):
+
+
+    def save_mc_function(self, writer: FunctionWriter = None):
         """
         Save the Minecraft function to program the screen
-        Use the path specified in the config file
+        Use the path specified in the config file,
+        or the function writer of the parent encoder if given
         """
+        # Open the function files or the datapack archive
+        if writer is None:
+            with FunctionWriter(self.config) as writer:
+                self.save_mc_function(writer)
+            return
+
+        # Save a function for each part of the video that fit in the barrels
+        if self.config.temporal_segmentation:
+            self.__save_segments(writer)
+            return
+
+        # Save a function for each screen of a tiled display
+        if self.config.tiles is not None:
+            self.__save_tiles(writer)
+            return
+
         # Generate the items buffer
-        print("Encoding video to items... ", end="", flush=True)
-        self.__encode_to_items()
-        print("Done")
+        if not self.encoded:
+            self.encode()
 
+        # Save the barrels in structure files placed by the function
+        if self.config.output_format == "structure":
+            self.__save_structures(writer)
+            return
+
+
+        with instrumentation.stage(
+            "emit",
+            "Generating the minecraft function",
+            unit="barrels",
+            total=self.config.x_resoulution * self.config.y_resoulution
+        ) as stage:
+            # Render the barrels of each block of columns
+            commands = self.__commands(stage)
+
+            # Render the next barrels while the previous ones are written
+            if self.config.pipelined:
+                commands = pipeline.prefetch(commands, self.config.pipeline_queue_size)
+
+            if self.config.shard_max_commands > 0 or self.config.shard_max_bytes > 0:
+                written = self.__save_shards(commands, writer)
+            else:
+                written = writer.write(self.config.function_name, commands, True)
+
+            stage.add("bytes", written)
+            self.written_bytes = written
+
+
+
+    def __save_structures(self, writer: FunctionWriter):
+        """
+        Save the barrels of the screen in structure files
+        and a function placing all of them
+        """
+        x_res = self.config.x_resoulution
+        y_res = self.config.y_resoulution
+
+        with instrumentation.stage(
+            "emit", "Generating the minecraft structures", unit="barrels", total=x_res * y_res
+        ) as stage:
+            structures = render_structures(
+                self.items_buffer.items,
+                self.items_buffer.offsets,
+                self.config.barrel_layout,
+                x_res,
+                y_res
+            )
+            stage.advance(x_res * y_res)
+
+            # Placing a template clears the replaced barrels,
+            # no item is dropped
+            written = 0
+            commands = []
+
+            for i, (origin, root) in enumerate(structures):
+                name = f"{self.config.function_name}_{i}"
+                written += writer.write_structure(name, root)
+
+                p_cmd = PLACE_TEMPLATE_CMD
+                p_cmd = p_cmd.replace("#template", f"{self.config.function_namespace}:{name}")
+                p_cmd = p_cmd.replace("#cord", origin.format())
+                commands.append(p_cmd)
+
+            written += writer.write(self.config.function_name, commands, False)
+
+            stage.add("structures", len(structures))
+            stage.add("bytes", written)
+            self.written_bytes = written
 
-        # Open the function file
-        with open(self.config.function_file_path, "w", encoding="utf8") as f:
-            print("Generating the minecraft function... ", end="", flush=True)
 
-            # Process all the pixel
-            for x in range(0, self.config.x_resoulution):
-                for y in range(0, self.config.y_resoulution):
-                    # Generate a new barrel with the pixel coordintes
-                    barrel = Barrel(x, y, self.config.barrel_layout)
-                    # Generate the first shulker
-                    shulker = Shulker()
 
-                    # Reset shulker and barrel slots counter
-                    s_counter, b_counter = 0, 0
+    def __save_segments(self, writer):
+        """
+        Split the video in frame ranges that fit in the barrels
+        and save a function to reload the screen for each of them
+        """
+        video_buf = self.video_buffer.video_buf
+        frames = self.video_buffer.output_frames
+
+        # The frame ranges are read many times while planning,
+        # from RAM or in chunks from the packed video file
+        if video_buf is not None:
+            count_items = lambda start, end: count_pixel_items(video_buf[start:end])
+        elif self.video_buffer.packed is not None:
+            count_items = lambda start, end: count_chunk_items(self.video_buffer.packed_chunks(start, end))
+        else:
+            raise Exception("temporal segmentation needs the video in RAM or in a packed video file")
+
+        # Plan the segments with a fast item count pre-pass
+        with instrumentation.stage("plan", "Planning the video segments", total=frames) as stage:
+            segments = plan_segments(frames, count_items)
+            stage.advance(frames)
+
+        # Save a function for each segment
+        scaling = self.config.output_fps_scaling
+        first_frame = self.video_buffer.first_frame
+
+        for index, (start, end) in enumerate(segments):
+            segment_config = self.config.segment_config(index)
+
+            print(
+                f"Segment {index}: frames {first_frame + (start * scaling)}"
+                f" to {first_frame + ((end - 1) * scaling)} -> {segment_config.function_name}"
+            )
+
+            segment_buf = BufferView(self.video_buffer, frame_range=(start, end))
+            MCencoder(segment_buf, segment_config).save_mc_function(writer)
+
+
+
+    def __save_tiles(self, writer):
+        """
+        Encode each tile of a tiled display and save its function file,
+        the tiles are processed in parallel if the video is in RAM
+        and the functions are not saved in a datapack archive
+        """
+        workers = self.config.emit_workers
+        tiles = self.config.tiles
+
+        # Get the settings and the video of each tile
+        tile_configs = [self.config.tile_config(tile) for tile in tiles]
+        tile_bufs = [
+            BufferView(
+                self.video_buffer,
+                (tile.x_start, tile.x_start + self.config.screen_x_res),
+                (tile.y_start, tile.y_start + self.config.screen_y_res)
+            )
+            for tile in tiles
+        ]
+
+        # Without the video in RAM or in a packed file each tile would decode the video again,
+        # encode all the tiles from a single decode pass instead
+        encoders = [None] * len(tiles)
+        if self.video_buffer.video_buf is None and self.video_buffer.packed is None:
+            encoders = [
+                MCencoder(tile_buf, tile_config)
+                for tile_config, tile_buf in zip(tile_configs, tile_bufs)
+            ]
+            self.__encode_tiles(encoders, tile_bufs)
+
+        with instrumentation.stage(
+            "tiles", "Generating the tiles functions", unit="tiles", total=len(tiles)
+        ) as stage:
+            if workers > 1 and self.video_buffer.video_buf is not None and writer.archive is None:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    for written in pool.map(save_tile_function, tile_configs, tile_bufs):
+                        stage.advance()
+                        stage.add("bytes", written)
+
+            else:
+                for tile_config, tile_buf, encoder in zip(tile_configs, tile_bufs, encoders):
+                    written = save_tile_function(tile_config, tile_buf, writer, encoder)
+                    stage.advance()
+                    stage.add("bytes", written)
+
+
+
+    def __encode_tiles(self, encoders, tile_bufs):
+        """
+        Encode all the tiles with a single pass on the video frames,
+        the encoder of each tile runs on its own thread
+        """
+        with instrumentation.stage(
+            "encode", "Encoding the tiles to items", total=self.video_buffer.output_frames
+        ) as stage:
+            # The tile encoders only report their timings
+            quiet = instrumentation.active.quiet
+            instrumentation.active.quiet = True
+
+            threads = [
+                pipeline.StageThread(
+                    lambda frames, encoder=encoder, tile_buf=tile_buf: encoder.encode(
+                        tile_buf.crop(frame) for frame in frames
+                    ),
+                    self.config.pipeline_queue_size
+                )
+                for encoder, tile_buf in zip(encoders, tile_bufs)
+            ]
+
+            try:
+                # Send each decoded frame to every tile
+                for frame in self.video_buffer.frames():
+                    for thread in threads:
+                        thread.put(frame)
+
+                    stage.advance()
+
+            finally:
+                # Wait for every tile before reporting their errors
+                errors = []
+                for thread in threads:
+                    try:
+                        thread.join()
+                    except Exception as e:
+                        errors.append(e)
+
+                instrumentation.active.quiet = quiet
+
+            if len(errors) > 0:
+                raise errors[0]
+
+
+
+    def __commands(self, stage):
+        """Yield the barrel commands of the screen in the output order"""
+        for block in self.__render_blocks():
+            stage.advance(len(block))
+            yield from block
+
+
+
+    def __save_shards(self, commands, writer: FunctionWriter):
+        """
+        Split the commands in multiple function files of bounded size
+        and save a driver function running one file per tick
+        Return the written bytes
+        """
+        max_commands = self.config.shard_max_commands
+        max_bytes = self.config.shard_max_bytes
+        dedup_kill = self.config.shard_dedup_kill
+
+        shard, shard_bytes, shard_count = [], 0, 0
+        written = 0
 
+        for command in commands:
+            # Save the current shard when the command doesn't fit in it
+            full_commands = max_commands > 0 and len(shard) >= max_commands
+            full_bytes = max_bytes > 0 and shard_bytes + len(command) > max_bytes
 
-                    # Add each item to a shulker
-                    for items in self.items_buffer.get_pixel_list(x, y):
-                        # Fill shulker slot with items and increment slots counter
-                        shulker.fill_slot(s_counter, items[0], items[1])
-                        s_counter += 1
+            if len(shard) > 0 and (full_commands or full_bytes):
+                written += writer.write(self.__shard_name(shard_count), shard, not dedup_kill)
+                shard, shard_bytes = [], 0
+                shard_count += 1
 
-                        # When the shulker is full add it to the barrel and create a new one
-                        if s_counter == SHULKER_SLOTS:
-                            # Add shulker to barrel and icrement slots counter
-                            barrel.fill_slot(b_counter, shulker)
-                            b_counter += 1
+            shard.append(command)
+            shard_bytes += len(command)
 
-                            # Get new empy shulker and reset slots counter
-                            shulker = Shulker()
-                            s_counter = 0
+        # The last shard always clean up the items
+        written += writer.write(self.__shard_name(shard_count), shard, True)
+        shard_count += 1
 
-                            # Check for overflow of the barrel
-                            if b_counter == BARREL_SLOTS:
-                                raise Exception("The video can't fit in screen memory")
 
+        # Run the first shard and schedule the others on the following ticks
+        driver = [f"function {self.__shard_id(0)}\n"]
+        for i in range(1, shard_count):
+            driver.append(f"schedule function {self.__shard_id(i)} {i}t\n")
 
-                    # At the end of the loop add the last shulker to the barrel
-                    barrel.fill_slot(b_counter, shulker)
+        written += writer.write(self.config.function_name, driver, False)
 
+        return written
+
+
+
+    def __shard_name(self, index):
+        """Return the function name of a function shard"""
+        return f"{self.config.function_name}_{index}"
+
+
+
+    def __shard_id(self, index):
+        """Return the in game function id of a function shard"""
+        return f"{self.config.function_namespace}:{self.__shard_name(index)}"
+
+
+
+    def __render_blocks(self):
+        """
+        Render the barrel commands of the screen split in blocks of columns
+        Yield the commands of each block in the output order
+        """
+        x_res = self.config.x_resoulution
+        y_res = self.config.y_resoulution
+        workers = self.config.emit_workers
+
+        # Split the screen in blocks of columns,
+        # one column per block on the main process
+        # or a few blocks for each worker to balance the load
+        block_count = x_res if workers <= 1 else min(x_res, workers * 4)
+        bounds = np.linspace(0, x_res, block_count + 1).astype(int).tolist()
+        blocks = list(zip(bounds[:-1], bounds[1:]))
+
+        # Reuse the cached barrels if available
+        if self.video_buffer.cache is not None:
+            yield from self.__render_cached(blocks)
+            return
+
+        # Get the arguments of each block
+        args = [
+            (*self.items_buffer.get_columns(*block), self.config.barrel_layout, block, y_res)
+            for block in blocks
+        ]
+
+        if workers > 1:
+            # Render the blocks in parallel, the results keep the blocks order
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                yield from pool.map(render_barrels, *zip(*args))
+
+        else:
+            # Share the rendered static barrels between the blocks
+            bodies = {}
+            for arg in args:
+                yield render_barrels(*arg, bodies)
+
+
+
+    def __render_cached(self, blocks):
+        """
+        Render the barrel commands reusing the cached barrels
+        Only the barrels of the pixels with new items are rendered,
+        in parallel if emit_workers > 1, the others only get the new coordinates
+        """
+        cache = self.video_buffer.cache
+        layout = self.config.barrel_layout
+        workers = self.config.emit_workers
+
+        cached_bodies = cache.load_barrels()
+
+        # Get the items hash of every pixel and the items of the missing barrels
+        block_hashes = []
+        missing = {}
+
+        for block in blocks:
+            hashes = []
+
+            for x in range(block[0], block[1]):
+                for y in range(0, self.config.y_resoulution):
+                    items = self.items_buffer.get_pixel_list(x, y)
+                    items_hash = hash_items(items)
+
+                    if items_hash not in cached_bodies and items_hash not in missing:
+                        missing[items_hash] = items.tobytes()
+
+                    hashes.append(items_hash)
+
+            block_hashes.append(hashes)
+
+        # Render the missing barrels
+        if workers > 1 and len(missing) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                rendered = pool.map(
+                    barrel_body,
+                    missing.values(),
+                    chunksize=max(1, len(missing) // (workers * 4))
+                )
+                missing = dict(zip(missing, rendered))
+        else:
+            missing = {items_hash: barrel_body(items) for items_hash, items in missing.items()}
+
+        # Barrels used by this run
+        bodies = {}
+
+        for block, hashes in zip(blocks, block_hashes):
+            commands = []
+            index = 0
+
+            for x in range(block[0], block[1]):
+                for y in range(0, self.config.y_resoulution):
+                    items_hash = hashes[index]
 
-                    # Save the barrel ouput on the file
-                    f.write(barrel.return_barrel())
+                    body = bodies.get(items_hash)
+                    if body is None:
+                        body = cached_bodies.get(items_hash)
+                    if body is None:
+                        body = missing[items_hash]
 
+                    bodies[items_hash] = body
+                    commands.append(place_barrel_body(layout.pixel_to_ingame(x, y), body))
+                    index += 1
 
-            # Terminate the file with a command to kill all the entity
-            # produce by the setblock commands
-            f.write("kill @e[type=minecraft:item]")
+            yield commands
 
-        print("Done")
-        
+        # Save the barrels of this run for the next one
+        cache.save_barrels(bodies)
@@ -0,0 +1,302 @@
+import gzip
+import io
+import struct
+
+
+
+
+# Tag types
+TAG_END = 0
+TAG_BYTE = 1
+TAG_SHORT = 2
+TAG_INT = 3
+TAG_LONG = 4
+TAG_FLOAT = 5
+TAG_DOUBLE = 6
+TAG_BYTE_ARRAY = 7
+TAG_STRING = 8
+TAG_LIST = 9
+TAG_COMPOUND = 10
+TAG_INT_ARRAY = 11
+TAG_LONG_ARRAY = 12
+
+
+
+
+# Typed values, the python int and float are written as Int and Double
+class Byte(int):
+    """NBT byte value"""
+    tag_type = TAG_BYTE
+
+
+class Short(int):
+    """NBT short value"""
+    tag_type = TAG_SHORT
+
+
+class Int(int):
+    """NBT int value"""
+    tag_type = TAG_INT
+
+
+class Long(int):
+    """NBT long value"""
+    tag_type = TAG_LONG
+
+
+class Float(float):
+    """NBT float value"""
+    tag_type = TAG_FLOAT
+
+
+class Double(float):
+    """NBT double value"""
+    tag_type = TAG_DOUBLE
+
+
+class ByteArray(bytes):
+    """NBT byte array value"""
+    tag_type = TAG_BYTE_ARRAY
+
+
+class IntArray(list):
+    """NBT int array value"""
+    tag_type = TAG_INT_ARRAY
+
+
+class LongArray(list):
+    """NBT long array value"""
+    tag_type = TAG_LONG_ARRAY
+
+
+
+
+class Raw:
+    """
+    An already encoded tag payload,
+    used to write large repeated values from precompiled fragments
+    """
+    def __init__(self, tag_type, payload) -> None:
+        self.tag_type = tag_type
+        self.payload = payload
+
+
+
+
+# Fixed size numbers
+NUMBER_FORMATS = {
+    TAG_BYTE: struct.Struct(">b"),
+    TAG_SHORT: struct.Struct(">h"),
+    TAG_INT: struct.Struct(">i"),
+    TAG_LONG: struct.Struct(">q"),
+    TAG_FLOAT: struct.Struct(">f"),
+    TAG_DOUBLE: struct.Struct(">d")
+}
+
+# Python class of each number tag type
+NUMBER_TYPES = {
+    TAG_BYTE: Byte,
+    TAG_SHORT: Short,
+    TAG_INT: Int,
+    TAG_LONG: Long,
+    TAG_FLOAT: Float,
+    TAG_DOUBLE: Double
+}
+
+LENGTH_FORMAT = NUMBER_FORMATS[TAG_INT]
+STRING_LENGTH_FORMAT = struct.Struct(">H")
+
+
+
+
+def tag_type(value):
+    """Return the tag type of a python value"""
+    if hasattr(value, "tag_type"):
+        return value.tag_type
+
+    if isinstance(value, bool):
+        return TAG_BYTE
+    if isinstance(value, int):
+        return TAG_INT
+    if isinstance(value, float):
+        return TAG_DOUBLE
+    if isinstance(value, str):
+        return TAG_STRING
+    if isinstance(value, (bytes, bytearray)):
+        return TAG_BYTE_ARRAY
+    if isinstance(value, list):
+        return TAG_LIST
+    if isinstance(value, dict):
+        return TAG_COMPOUND
+
+    raise Exception(f"no NBT tag for {type(value).__name__} values")
+
+
+
+def string_payload(value):
+    """Return the payload of a string, with the length before the UTF-8 bytes"""
+    data = value.encode("utf8")
+    return STRING_LENGTH_FORMAT.pack(len(data)) + data
+
+
+
+def named(name, value):
+    """Return a named tag, as found in a compound"""
+    return bytes([tag_type(value)]) + string_payload(name) + payload(value)
+
+
+
+def list_head(item_type, length):
+    """Return the start of a list payload, the items payloads follow"""
+    return bytes([item_type]) + LENGTH_FORMAT.pack(length)
+
+
+
+def payload(value):
+    """Return the payload of a value, without its tag type and name"""
+    value_type = tag_type(value)
+
+    if isinstance(value, Raw):
+        return value.payload
+
+    if value_type in NUMBER_FORMATS:
+        return NUMBER_FORMATS[value_type].pack(value)
+
+    if value_type == TAG_STRING:
+        return string_payload(value)
+
+    if value_type == TAG_BYTE_ARRAY:
+        return LENGTH_FORMAT.pack(len(value)) + bytes(value)
+
+    if value_type == TAG_INT_ARRAY:
+        return LENGTH_FORMAT.pack(len(value)) + struct.pack(f">{len(value)}i", *value)
+
+    if value_type == TAG_LONG_ARRAY:
+        return LENGTH_FORMAT.pack(len(value)) + struct.pack(f">{len(value)}q", *value)
+
+    if value_type == TAG_LIST:
+        # All the items of a list have the same type, End for an empty list
+        item_type = tag_type(value[0]) if len(value) > 0 else TAG_END
+
+        parts = [list_head(item_type, len(value))]
+        for item in value:
+            if tag_type(item) != item_type:
+                raise Exception("NBT list items of different types")
+
+            parts.append(payload(item))
+
+        return b"".join(parts)
+
+    # Compound: the named tags then an End tag
+    parts = [named(name, item) for name, item in value.items()]
+    parts.append(bytes([TAG_END]))
+
+    return b"".join(parts)
+
+
+
+def dumps(root, name=""):
+    """Return the uncompressed NBT data of a root compound"""
+    if tag_type(root) != TAG_COMPOUND:
+        raise Exception("the NBT root must be a compound")
+
+    return named(name, root)
+
+
+
+def save(path, root, name=""):
+    """Save a root compound to a gzip compressed NBT file"""
+    with gzip.open(path, "wb") as f:
+        f.write(dumps(root, name))
+
+
+
+
+class Reader:
+    """Read the values of NBT data as the typed python values of this module"""
+    def __init__(self, data) -> None:
+        self.stream = io.BytesIO(data)
+
+
+
+    def __read(self, size):
+        """Read exactly size bytes"""
+        data = self.stream.read(size)
+        if len(data) != size:
+            raise Exception("truncated NBT data")
+
+        return data
+
+
+
+    def __unpack(self, fmt):
+        """Read a fixed size number"""
+        return fmt.unpack(self.__read(fmt.size))[0]
+
+
+
+    def string(self):
+        """Read a string payload"""
+        return self.__read(self.__unpack(STRING_LENGTH_FORMAT)).decode("utf8")
+
+
+
+    def payload(self, value_type):
+        """Read the payload of a value of the given type"""
+        if value_type in NUMBER_FORMATS:
+            return NUMBER_TYPES[value_type](self.__unpack(NUMBER_FORMATS[value_type]))
+
+        if value_type == TAG_STRING:
+            return self.string()
+
+        if value_type == TAG_BYTE_ARRAY:
+            return ByteArray(self.__read(self.__unpack(LENGTH_FORMAT)))
+
+        if value_type == TAG_INT_ARRAY:
+            length = self.__unpack(LENGTH_FORMAT)
+            return IntArray(struct.unpack(f">{length}i", self.__read(length * 4)))
+
+        if value_type == TAG_LONG_ARRAY:
+            length = self.__unpack(LENGTH_FORMAT)
+            return LongArray(struct.unpack(f">{length}q", self.__read(length * 8)))
+
+        if value_type == TAG_LIST:
+            item_type = self.__read(1)[0]
+            length = self.__unpack(LENGTH_FORMAT)
+            return [self.payload(item_type) for _ in range(0, length)]
+
+        if value_type == TAG_COMPOUND:
+            value = {}
+            while True:
+                item_type = self.__read(1)[0]
+                if item_type == TAG_END:
+                    return value
+
+                name = self.string()
+                value[name] = self.payload(item_type)
+
+        raise Exception(f"unknown NBT tag type {value_type}")
+
+
+
+    def root(self):
+        """Read the root named compound, return its name and value"""
+        if self.__read(1)[0] != TAG_COMPOUND:
+            raise Exception("the NBT root must be a compound")
+
+        name = self.string()
+        return name, self.payload(TAG_COMPOUND)
+
+
+
+
+def loads(data):
+    """Return the name and the value of the root compound of uncompressed NBT data"""
+    return Reader(data).root()
+
+
+
+def load(path):
+    """Return the name and the value of the root compound of a gzip compressed NBT file"""
+    with gzip.open(path, "rb") as f:
+        return loads(f.read())
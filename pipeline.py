@@ -0,0 +1,190 @@
+import queue
+import threading
+
+import instrumentation
+
+
+
+
+# Marker of the end of a stage input
+END = object()
+
+
+
+
+class StageThread:
+    """
+    A pipeline stage running on its own thread
+    The stage function is called with an iterator on the items put in its bounded queue
+    """
+    def __init__(self, function, queue_size) -> None:
+        self.function = function
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        self.result = None
+        self.error = None
+        self.finished = False
+
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+
+
+    def __items(self):
+        """Yield the queued items until the end marker"""
+        while True:
+            item = self.queue.get()
+            if item is END:
+                self.finished = True
+                return
+
+            yield item
+
+
+
+    def __run(self):
+        """Run the stage function on the queued items"""
+        try:
+            self.result = self.function(self.__items())
+        except Exception as e:
+            self.error = e
+
+        # Drop the items the stage didn't use so the producer never blocks
+        if not self.finished:
+            for _ in self.__items():
+                pass
+
+
+
+    def put(self, item):
+        """Queue an item, wait if the queue is full"""
+        self.queue.put(item)
+
+
+
+    def join(self):
+        """
+        Close the stage input and wait for the stage to finish
+        Return the result of the stage function
+        """
+        self.queue.put(END)
+        self.thread.join()
+
+        if self.error is not None:
+            raise self.error
+
+        return self.result
+
+
+
+
+def prefetch(iterable, queue_size):
+    """
+    Yield the items of an iterable produced ahead on a separate thread,
+    at most queue_size items are waiting at the same time
+    """
+    items = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+
+    def put(item):
+        # Give up if the items are not read anymore
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except Exception as e:
+            errors.append(e)
+
+        put(END)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = items.get()
+            if item is END:
+                break
+
+            yield item
+
+    finally:
+        stop.set()
+        thread.join()
+
+    if len(errors) > 0:
+        raise errors[0]
+
+
+
+
+def run(buffer, encoder, config):
+    """
+    Decode the video once and feed each frame at the same time
+    to the encoder and to the debug videos writer, each running on its own thread
+    The function is then saved by save_mc_function from the encoded items
+    """
+    debug = config.generate_debug_video
+    update_map = config.generate_pixel_update_video
+
+    # Get the stages fed with the frames
+    stages = []
+
+    # The tiles and the segments are encoded from their own part of the video
+    if config.generate_minecraft_fun and config.tiles is None and not config.temporal_segmentation:
+        # Encode the whole video at once if it is in RAM
+        if buffer.video_buf is not None:
+            stages.append(lambda frames: encoder.encode())
+        else:
+            stages.append(encoder.encode)
+
+    if debug or update_map:
+        stages.append(
+            lambda frames: buffer.generate_diagnostic_videos(debug, update_map, frames=frames)
+        )
+
+    if len(stages) == 0:
+        return
+
+
+    with instrumentation.stage(
+        "pipeline", "Processing the video frames", total=buffer.output_frames
+    ) as stage:
+        # The stages only report their timings
+        quiet = instrumentation.active.quiet
+        instrumentation.active.quiet = True
+
+        threads = [StageThread(function, config.pipeline_queue_size) for function in stages]
+
+        try:
+            # Decode the frames on a separate thread and send them to every stage
+            for frame in prefetch(buffer.frames(), config.pipeline_queue_size):
+                for thread in threads:
+                    thread.put(frame)
+
+                stage.advance()
+
+        finally:
+            # Wait for every stage before reporting their errors
+            errors = []
+            for thread in threads:
+                try:
+                    thread.join()
+                except Exception as e:
+                    errors.append(e)
+
+            instrumentation.active.quiet = quiet
+
+        if len(errors) > 0:
+            raise errors[0]
@@ -1,19 +1,46 @@
 import configparser
+import copy
 import os
+import re
 import sys
 
-from minecraft_classes import BarrelLayour, Coordinates
+from minecraft_classes import BarrelLayour, Coordinates, ScreenTile
+
+
+
+
+def parse_coordinates(coordinates_str):
+    """Convert a "x,y,z" string to a Coordinates object"""
+    coordinates = [int(x) for x in coordinates_str.split(",")]
+
+    # Check the list len
+    if len(coordinates) != 3:
+        raise Exception("Screen origin shape mismatch")
+
+    # Create Coordinates object
+    return Coordinates(
+        coordinates[0],
+        coordinates[1],
+        coordinates[2]
+    )
 
 
 class Config:
     """Configuration class"""
-    def __init__(self, config_file_path) -> None:
-        """Parse a config file and return a config object"""
+    def __init__(self, config_file_path, overrides=None) -> None:
+        """
+        Parse a config file and return a config object
+        overrides is an optional dictionary of settings by section
+        replacing the ones of the file
+        """
 
         # Get the config parser
         parser = configparser.ConfigParser()
         parser.read(config_file_path)
 
+        if overrides is not None:
+            parser.read_dict(overrides)
+
 
         # Parse input file settings
         input_files_cfg = parser["input_file"]
@@ -43,6 +70,68 @@ class Config:
         self.finish_frame = out_screen_cfg.getint("finish_frame")
 
 
+        # Parse processing settings
+        # Stream the frames instead of loading the whole video in RAM
+        self.streaming = parser.getboolean("processing", "streaming", fallback=False)
+        # Seek directly to the start frame instead of decoding the frames before it
+        self.seek_to_start = parser.getboolean("processing", "seek_to_start", fallback=True)
+        # Number of worker processes used to decode the video
+        self.decode_workers = parser.getint("processing", "decode_workers", fallback=1)
+        # Number of worker processes used to render the barrel commands
+        self.emit_workers = parser.getint("processing", "emit_workers", fallback=1)
+        # Bit-packed processed video file reused by the next runs (empty : disabled)
+        self.packed_video_path = parser.get("processing", "packed_video_path", fallback="")
+        # Hash of the input video when already known, set by the batch runner (None : computed)
+        self.source_hash = None
+        # Encode the debug videos on a background thread
+        self.background_video_writer = parser.getboolean(
+            "processing", "background_video_writer", fallback=True
+        )
+        # Decoder of the input video: opencv, ffmpeg or auto
+        self.input_backend = parser.get("processing", "input_backend", fallback="opencv")
+        self.ffmpeg_path = parser.get("processing", "ffmpeg_path", fallback="ffmpeg")
+        # Run the decode, encode, debug videos and function writing stages at the same time
+        self.pipelined = parser.getboolean("processing", "pipelined", fallback=False)
+        # Maximum frames or commands blocks waiting between two pipeline stages
+        self.pipeline_queue_size = parser.getint("processing", "pipeline_queue_size", fallback=16)
+
+
+        # Parse temporal filter settings
+        # Gray levels a pixel must cross the threshold by to flip
+        self.threshold_margin = parser.getint("temporal_filter", "threshold_margin", fallback=0)
+        # Minimum frames a pixel must stay flipped, the shorter flips are dropped
+        self.hold_frames = parser.getint("temporal_filter", "hold_frames", fallback=1)
+
+        # Check the filter settings, saved unsigned in the packed video header
+        try:
+            if self.threshold_margin < 0:
+                raise Exception("threshold_margin must be 0 or more")
+            if self.hold_frames < 1:
+                raise Exception("hold_frames must be 1 or more")
+
+        except Exception as e:
+            print(f"temporal filter parsing failed: {e}")
+            sys.exit(1)
+
+        self.temporal_filter = self.threshold_margin > 0 or self.hold_frames > 1
+
+
+        # Parse cache settings
+        # Folder of the intermediate results cache (empty : no cache)
+        self.cache_dir = parser.get("cache", "cache_dir", fallback="")
+
+
+        # Parse instrumentation settings
+        # Print the stages progress while running
+        self.progress = parser.getboolean("instrumentation", "progress", fallback=False)
+        self.progress_interval = parser.getfloat("instrumentation", "progress_interval", fallback=1.0)
+        # JSON timing report of the stages (empty : no report)
+        self.timing_report_path = parser.get("instrumentation", "timing_report_path", fallback="")
+        # Save a cProfile file for each stage
+        self.profile_stages = parser.getboolean("instrumentation", "profile_stages", fallback=False)
+        self.profile_dir = parser.get("instrumentation", "profile_dir", fallback="profiles")
+
+
         # Parse minecraft file ouput settings
         mc_file_cfg = parser["minecraft_output"]
 
@@ -54,6 +143,45 @@ class Config:
         # Generate the file path
         self.function_file_path = os.path.join(functions_path, (function_name + function_ext))
 
+        self.functions_path = functions_path
+        self.function_name = function_name
+        self.function_ext = function_ext
+
+        # Datapack namespace, by default the folder containing the functions folder
+        self.function_namespace = mc_file_cfg.get("function_namespace", fallback="")
+        if self.function_namespace == "":
+            path_parts = re.split(r"[\\/]+", functions_path.rstrip("\\/"))
+            self.function_namespace = path_parts[-2] if len(path_parts) > 1 else function_name
+
+        # Split the function in multiple files run over successive ticks
+        # 0 : no limit
+        self.shard_max_commands = mc_file_cfg.getint("shard_max_commands", fallback=0)
+        self.shard_max_bytes = mc_file_cfg.getint("shard_max_bytes", fallback=0)
+        # Kill the dropped items only after the last shard
+        self.shard_dedup_kill = mc_file_cfg.getboolean("shard_dedup_kill", fallback=True)
+
+        # Save the functions in a zip datapack archive instead of functions_path
+        # (empty : loose function files)
+        self.datapack_path = mc_file_cfg.get("datapack_path", fallback="")
+        self.pack_format = mc_file_cfg.getint("pack_format", fallback=15)
+
+        # Split the video in frame ranges that fit in the barrels,
+        # with a reload function for each of them
+        self.temporal_segmentation = mc_file_cfg.getboolean("temporal_segmentation", fallback=False)
+
+        # Output of the barrels: setblock commands in the function file,
+        # or structure files placed by the function file
+        self.output_format = mc_file_cfg.get("output_format", fallback="commands")
+        if self.output_format not in ("commands", "structure"):
+            raise Exception(f"unknown output format {self.output_format}")
+
+        # Folder of the structure files, by default next to the functions folder
+        self.structures_path = mc_file_cfg.get("structures_path", fallback="")
+        if self.structures_path == "":
+            self.structures_path = os.path.join(
+                os.path.dirname(functions_path.rstrip("\\/")), "structures"
+            )
+
 
         # Parse screen property settings
         screen_property = parser["screen_property"]
@@ -65,18 +193,7 @@ class Config:
 
         # Convert origin str to Coorinates object
         try:
-            screen_origin = [int(x) for x in screen_origin_str.split(",")]
-
-            # Check the list len
-            if len(screen_origin) != 3:
-                raise Exception("Screen origin shape mismatch")
-
-            # Create Coordinates object
-            self.origin = Coordinates(
-                screen_origin[0],
-                screen_origin[1],
-                screen_origin[2]
-            )
+            self.origin = parse_coordinates(screen_origin_str)
 
         except Exception as e:
             print(f"coordinates parsing failed: {e}")
@@ -85,4 +202,102 @@ class Config:
 
         # Create the Barrel layout object
         self.barrel_layout = BarrelLayour(self.origin, row_offset, column_offset)
-        
+
+
+        # Tiled mode: a grid of screens showing one video,
+        # x_resoulution and y_resoulution are the resolution of each screen
+        self.tile_columns = screen_property.getint("tile_columns", fallback=1)
+        self.tile_rows = screen_property.getint("tile_rows", fallback=1)
+        tile_origins_str = screen_property.get("tile_origins", fallback="")
+
+        self.tiles = None
+        if tile_origins_str.strip() != "":
+            # One origin per line, row by row
+            try:
+                tile_origins = [parse_coordinates(x) for x in tile_origins_str.split()]
+
+                if len(tile_origins) != self.tile_columns * self.tile_rows:
+                    raise Exception("tile origins count mismatch")
+
+            except Exception as e:
+                print(f"tile origins parsing failed: {e}")
+                sys.exit(1)
+
+            # Get the screen of each tile
+            self.tiles = []
+            for i, tile_origin in enumerate(tile_origins):
+                row, column = divmod(i, self.tile_columns)
+
+                self.tiles.append(ScreenTile(
+                    row,
+                    column,
+                    column * self.x_resoulution,
+                    row * self.y_resoulution,
+                    BarrelLayour(tile_origin, row_offset, column_offset)
+                ))
+
+            # The video is processed at the combined resolution
+            self.screen_x_res = self.x_resoulution
+            self.screen_y_res = self.y_resoulution
+
+            self.x_resoulution = self.screen_x_res * self.tile_columns
+            self.y_resoulution = self.screen_y_res * self.tile_rows
+
+
+
+    def segment_config(self, index):
+        """Return the settings of a single temporal segment of the video"""
+        config = copy.copy(self)
+
+        config.temporal_segmentation = False
+
+        # Each segment has its own function file
+        config.function_name = f"{self.function_name}_seg{index}"
+        config.function_file_path = os.path.join(
+            self.functions_path, config.function_name + self.function_ext
+        )
+
+        return config
+
+
+
+    def tile_config(self, tile):
+        """Return the settings of a single tile screen"""
+        config = copy.copy(self)
+
+        config.tiles = None
+        config.x_resoulution = self.screen_x_res
+        config.y_resoulution = self.screen_y_res
+        config.barrel_layout = tile.layout
+        config.origin = tile.layout.origin
+
+        # Each tile has its own function file
+        config.function_name = f"{self.function_name}_{tile.row}_{tile.column}"
+        config.function_file_path = os.path.join(
+            self.functions_path, config.function_name + self.function_ext
+        )
+
+        # The tiles are already processed in parallel without cache
+        config.emit_workers = 1
+        config.cache_dir = ""
+
+        return config
+
+
+
+    def buffer_settings(self, backend):
+        """
+        Return the settings changing the content of the processed video buffer
+        backend is the decoder resolved from input_backend,
+        the decoders can round the gray levels differently
+        """
+        return [
+            backend,
+            self.x_resoulution,
+            self.y_resoulution,
+            self.output_fps_scaling,
+            self.start_frame,
+            self.finish_frame,
+            self.threshold_margin,
+            self.hold_frames
+        ]
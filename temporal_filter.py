@@ -0,0 +1,103 @@
+import numpy as np
+
+
+
+
+# Gray level threshold of the processed frames, the pixels above it are white
+THRESHOLD = 127
+
+
+
+
+def threshold(gray_buf):
+    """Convert a gray scale video buffer to a binary set of 0 and 1"""
+    return (gray_buf > THRESHOLD).astype(np.dtype("uint8"))
+
+
+
+def count_runs(video_buf):
+    """Return the number of pixel runs of a binary video buffer"""
+    if len(video_buf) == 0:
+        return 0
+
+    # Every pixel starts a run on the first frame and on every change
+    return int(video_buf[0].size + np.count_nonzero(video_buf[1:] != video_buf[:-1]))
+
+
+
+def forward_fill(video_buf, decisive):
+    """
+    Replace the non decisive frames of each pixel
+    with the value of the pixel on its last decisive frame
+    The first frame must be decisive
+    """
+    frames = len(video_buf)
+
+    # Index of the last decisive frame of each pixel
+    index = np.where(decisive, np.arange(frames, dtype=np.int32).reshape(-1, 1, 1), 0)
+    np.maximum.accumulate(index, axis=0, out=index)
+
+    return np.take_along_axis(video_buf, index, axis=0)
+
+
+
+def hysteresis(gray_buf, margin):
+    """
+    Threshold a gray scale video buffer with hysteresis
+    A pixel only flips when it crosses the threshold by more than margin gray levels,
+    the pixels closer to the threshold keep their previous color
+    """
+    video_buf = threshold(gray_buf)
+
+    if margin <= 0 or len(gray_buf) == 0:
+        return video_buf
+
+    decisive = (gray_buf > THRESHOLD + margin) | (gray_buf <= THRESHOLD - margin)
+    decisive[0] = True
+
+    return forward_fill(video_buf, decisive)
+
+
+
+def debounce(video_buf, hold_frames):
+    """
+    Drop the pixel runs shorter than hold_frames from a binary video buffer,
+    the pixel keeps its color from before the dropped run
+    """
+    frames = len(video_buf)
+
+    if hold_frames <= 1 or frames == 0:
+        return video_buf
+
+    frame_index = np.arange(frames, dtype=np.int32).reshape(-1, 1, 1)
+    changes = video_buf[1:] != video_buf[:-1]
+
+    # First frame of the run of each frame
+    run_start = np.zeros(video_buf.shape, np.dtype("int32"))
+    run_start[1:] = np.where(changes, frame_index[1:], 0)
+    np.maximum.accumulate(run_start, axis=0, out=run_start)
+
+    # Last frame of the run of each frame
+    run_end = np.full(video_buf.shape, frames - 1, np.dtype("int32"))
+    run_end[:-1] = np.where(changes, frame_index[:-1], frames - 1)
+    run_end = np.minimum.accumulate(run_end[::-1], axis=0)[::-1]
+
+    # Only the frames of the long enough runs are kept
+    decisive = (run_end - run_start + 1) >= hold_frames
+    decisive[0] = True
+
+    return forward_fill(video_buf, decisive)
+
+
+
+def filter_video(gray_buf, margin, hold_frames):
+    """
+    Convert a gray scale video buffer to a binary one,
+    removing the pixel flickers around the threshold
+    Return the binary video buffer and the number of pixel runs saved
+    compared to a fixed threshold
+    """
+    video_buf = debounce(hysteresis(gray_buf, margin), hold_frames)
+    runs_saved = count_runs(threshold(gray_buf)) - count_runs(video_buf)
+
+    return video_buf, runs_saved
@@ -0,0 +1,105 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+
+# The modules are at the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from settings import Config
+
+
+# Config file of the repository, the tests replace its paths
+REPO_CONFIG = os.path.join(ROOT, "config.cfg")
+
+# Size of the blocks of the test videos, the scaled frames stay black and white
+VIDEO_BLOCK = 4
+
+
+
+
+def write_video(path, frames, fps=20):
+    """Save binary frames to a lossless video, each pixel as a VIDEO_BLOCK square"""
+    frames = np.asarray(frames, np.dtype("uint8")) * 255
+    frames = frames.repeat(VIDEO_BLOCK, axis=1).repeat(VIDEO_BLOCK, axis=2)
+
+    writer = cv2.VideoWriter(
+        str(path), cv2.VideoWriter_fourcc(*"FFV1"), fps, (frames.shape[2], frames.shape[1])
+    )
+    for frame in frames:
+        writer.write(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+
+    writer.release()
+    return str(path)
+
+
+
+def random_frames(frames, y_res, x_res, seed, hold=0.8):
+    """Random binary frames, each pixel held for a random number of frames"""
+    rng = np.random.default_rng(seed)
+    video_buf = rng.integers(0, 2, (frames, y_res, x_res), np.dtype("uint8"))
+
+    keep = rng.random((frames, y_res, x_res)) < hold
+    for frame in range(1, frames):
+        video_buf[frame] = np.where(keep[frame], video_buf[frame - 1], video_buf[frame])
+
+    return video_buf
+
+
+
+
+@pytest.fixture
+def video_frames():
+    """Binary frames of the test video, at the output resolution"""
+    return random_frames(120, 9, 12, 0)
+
+
+
+@pytest.fixture
+def video_path(tmp_path, video_frames):
+    """Lossless test video of the video_frames"""
+    return write_video(tmp_path / "video.avi", video_frames)
+
+
+
+@pytest.fixture
+def make_config(tmp_path):
+    """
+    Return a function building the config of a test run from the repository config,
+    with its output files in the test folder and the given overrides by section
+    """
+    def make(video, overrides=None):
+        functions_path = tmp_path / "functions"
+        functions_path.mkdir(exist_ok=True)
+
+        settings = {
+            "input_file": {"input_video_file": str(video)},
+            "output_files": {
+                "generate_debug_video": "False",
+                "generate_pixel_update_video": "False",
+                "debug_video_path": str(tmp_path / "debug.avi"),
+                "update_map_video_path": str(tmp_path / "update_map.avi")
+            },
+            "output_screen": {
+                "x_resoulution": "12",
+                "y_resoulution": "9",
+                "output_fps_scaling": "1",
+                "start_frame": "0",
+                "finish_frame": "-1"
+            },
+            "minecraft_output": {
+                "functions_path": str(functions_path),
+                "function_namespace": "prog"
+            }
+        }
+
+        for section, values in (overrides or {}).items():
+            settings.setdefault(section, {}).update(values)
+
+        return Config(REPO_CONFIG, settings)
+
+    return make
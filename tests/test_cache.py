@@ -0,0 +1,95 @@
+import pytest
+
+from encoding_cache import EncodingCache
+from minecraft_encoder import MCencoder
+from video_processing import MCBuffer
+
+
+
+
+@pytest.fixture
+def cache_log(monkeypatch):
+    """Record the hits of the cache loads and the barrels saved by each run"""
+    log = {"buffer": [], "items": [], "loaded_barrels": [], "saved_barrels": []}
+
+    load_buffer, load_items = EncodingCache.load_buffer, EncodingCache.load_items
+    load_barrels, save_barrels = EncodingCache.load_barrels, EncodingCache.save_barrels
+
+    def spy_load_buffer(self, key):
+        video_buf = load_buffer(self, key)
+        log["buffer"].append(video_buf is not None)
+        return video_buf
+
+    def spy_load_items(self, key):
+        items = load_items(self, key)
+        log["items"].append(items is not None)
+        return items
+
+    def spy_load_barrels(self):
+        bodies = load_barrels(self)
+        log["loaded_barrels"].append(bodies)
+        return bodies
+
+    def spy_save_barrels(self, bodies):
+        log["saved_barrels"].append(bodies)
+        save_barrels(self, bodies)
+
+    monkeypatch.setattr(EncodingCache, "load_buffer", spy_load_buffer)
+    monkeypatch.setattr(EncodingCache, "load_items", spy_load_items)
+    monkeypatch.setattr(EncodingCache, "load_barrels", spy_load_barrels)
+    monkeypatch.setattr(EncodingCache, "save_barrels", spy_save_barrels)
+
+    return log
+
+
+
+def run(make_config, video_path, cache_dir=None, overrides=None):
+    """Encode the test video, with the cache if cache_dir is given, return the function file"""
+    overrides = dict(overrides or {})
+    if cache_dir is not None:
+        overrides["cache"] = {"cache_dir": str(cache_dir)}
+
+    config = make_config(video_path, overrides)
+    MCencoder(MCBuffer(config), config).save_mc_function()
+
+    with open(config.function_file_path, "r", encoding="utf8") as f:
+        return f.read()
+
+
+
+
+@pytest.mark.parametrize("emit_workers", ["1", "2"])
+def test_cache_cold_warm(tmp_path, make_config, video_path, cache_log, emit_workers):
+    cache_dir = tmp_path / "cache"
+    processing = {"processing": {"emit_workers": emit_workers}}
+
+    expected = run(make_config, video_path, overrides=processing)
+
+    # Cold run
+    assert run(make_config, video_path, cache_dir, processing) == expected
+    assert cache_log["buffer"] == [False] and cache_log["items"] == [False]
+
+    # Warm run: the buffer, the items and every barrel come from the cache
+    assert run(make_config, video_path, cache_dir, processing) == expected
+    assert cache_log["buffer"] == [False, True] and cache_log["items"] == [False, True]
+    assert set(cache_log["saved_barrels"][-1]) <= set(cache_log["loaded_barrels"][-1])
+
+
+
+@pytest.mark.parametrize("overrides", [
+    {"output_screen": {"start_frame": "2"}},
+    {"output_screen": {"x_resoulution": "10"}},
+    {"output_screen": {"y_resoulution": "7"}}
+])
+def test_cache_miss(tmp_path, make_config, video_path, cache_log, overrides):
+    cache_dir = tmp_path / "cache"
+
+    run(make_config, video_path, cache_dir)
+    run(make_config, video_path, cache_dir)
+    assert cache_log["buffer"] == [False, True] and cache_log["items"] == [False, True]
+
+    # A processed video setting changed, the buffer and the items are encoded again
+    output = run(make_config, video_path, cache_dir, overrides)
+    assert cache_log["buffer"][-1] is False and cache_log["items"][-1] is False
+
+    assert output == run(make_config, video_path, overrides=overrides)
@@ -0,0 +1,41 @@
+import threading
+
+import cv2
+import pytest
+
+from video_processing import MCBuffer
+
+
+
+
+def count_frames(path):
+    """Return the number of frames readable from a video file"""
+    cap = cv2.VideoCapture(path)
+    frames = 0
+    while cap.read()[0]:
+        frames += 1
+
+    cap.release()
+    return frames
+
+
+
+
+@pytest.mark.parametrize("background", ["True", "False"])
+def test_diagnostic_videos_error(make_config, video_path, video_frames, background):
+    config = make_config(video_path, {"processing": {"background_video_writer": background}})
+    buf = MCBuffer(config)
+
+    def failing_frames():
+        yield from video_frames[:10]
+        raise ValueError("frame failed")
+
+    threads = threading.active_count()
+
+    with pytest.raises(ValueError):
+        buf.generate_diagnostic_videos(frames=failing_frames())
+
+    # The writer threads are stopped and the videos closed with the written frames
+    assert threading.active_count() == threads
+    assert count_frames(config.debug_video_path) == 10
+    assert count_frames(config.update_map_video_path) == 9
@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from minecraft_encoder import MCencoder
+from video_processing import MCBuffer
+
+
+
+
+@pytest.fixture
+def broken_video(tmp_path, video_path):
+    """Video file with a readable header announcing frames that can't be decoded"""
+    with open(video_path, "rb") as f:
+        data = f.read(6000)
+
+    path = tmp_path / "broken.avi"
+    with open(path, "wb") as f:
+        f.write(data)
+
+    return str(path)
+
+
+
+
+@pytest.mark.parametrize("decode_workers", ["1", "2"])
+def test_no_frame_in_ram(make_config, broken_video, decode_workers):
+    config = make_config(broken_video, {"processing": {"decode_workers": decode_workers}})
+
+    with pytest.raises(Exception, match="No frame decoded"):
+        MCBuffer(config)
+
+
+
+def test_no_frame_streaming(make_config, broken_video):
+    config = make_config(broken_video, {"processing": {"streaming": "True"}})
+    buf = MCBuffer(config)
+
+    with pytest.raises(Exception, match="No frame decoded"):
+        MCencoder(buf, config).encode()
+
+    with pytest.raises(Exception, match="No frame decoded"):
+        buf.change_index()
+
+
+
+def test_no_frame_packed(tmp_path, make_config, broken_video):
+    packed_path = str(tmp_path / "broken.rvpk")
+    config = make_config(broken_video, {
+        "processing": {"streaming": "True", "packed_video_path": packed_path}
+    })
+
+    with pytest.raises(Exception, match="No frame decoded"):
+        MCBuffer(config)
+
+    # No empty packed video is left for the next runs
+    assert not os.path.exists(packed_path)
+    assert not os.path.exists(packed_path + ".tmp")
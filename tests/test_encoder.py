@@ -0,0 +1,251 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from minecraft_encoder import find_runs, encode_runs, split_runs, RunTracker
+from minecraft_encoder import count_pixel_items, count_chunk_items, plan_segments, ItemBuffer
+from minecraft_classes import ITEM_STACK_SIZE, MAX_BARREL_ITEMS, ITEM_COLOR_SHIFT, ITEM_COUNT_MASK
+from minecraft_classes import ITEM_CMD, SHULKER_CMD, BARREL_CMD, ITEM_ID_DICT, SHULKER_SLOTS
+from minecraft_classes import Coordinates, barrel_command
+from change_index import ChangeIndex
+
+
+
+
+def reference_items(video_buf):
+    """
+    Per pixel loop of the original encoder
+    Return the list of (color, count) items of each pixel in pixel index order
+    """
+    frames, y_res, x_res = video_buf.shape
+    items = []
+
+    for x in range(0, x_res):
+        for y in range(0, y_res):
+            pixel_items = []
+            color, count = video_buf[0, y, x], 0
+
+            for frame in range(0, frames):
+                # A new item starts on each update and after a full stack
+                if video_buf[frame, y, x] != color or count == ITEM_STACK_SIZE:
+                    pixel_items.append((int(color), count))
+                    color, count = video_buf[frame, y, x], 0
+
+                count += 1
+
+            pixel_items.append((int(color), count))
+            items.append(pixel_items)
+
+    return items
+
+
+
+def group_items(pixels, colors, counts, pixel_count):
+    """Return the items of each pixel from the flat item arrays"""
+    items = [[] for _ in range(0, pixel_count)]
+
+    for pixel, color, count in zip(pixels.tolist(), colors.tolist(), counts.tolist()):
+        items[pixel].append((color, count))
+
+    return items
+
+
+
+def toggle_buffer(frames, y_res, x_res):
+    """Every pixel changes on every frame"""
+    video_buf = np.zeros((frames, y_res, x_res), np.dtype("uint8"))
+    video_buf[1::2] = 1
+    return video_buf
+
+
+
+def long_runs_buffer(frames, y_res, x_res):
+    """Runs longer than a stack with a different phase for each pixel"""
+    t = np.arange(0, frames).reshape(-1, 1, 1)
+    phase = np.arange(0, y_res * x_res).reshape(1, y_res, x_res)
+    return (((t + (phase * 37)) // 150) % 2).astype(np.dtype("uint8"))
+
+
+
+def random_buffer(frames, y_res, x_res, seed):
+    """Random pixels held for a random number of frames"""
+    rng = np.random.default_rng(seed)
+    video_buf = rng.integers(0, 2, (frames, y_res, x_res), np.dtype("uint8"))
+
+    # Hold some of the frames to get runs of every length
+    hold = rng.random(frames) < 0.8
+    for frame in range(1, frames):
+        if hold[frame]:
+            video_buf[frame] = video_buf[frame - 1]
+
+    return video_buf
+
+
+BUFFERS = {
+    "random": random_buffer(300, 6, 5, 0),
+    "random_long": random_buffer(1000, 3, 4, 1),
+    "all_zero": np.zeros((200, 4, 3), np.dtype("uint8")),
+    "all_one": np.ones((129, 2, 3), np.dtype("uint8")),
+    "all_toggle": toggle_buffer(150, 3, 4),
+    "long_runs": long_runs_buffer(700, 3, 3),
+    "single_frame": random_buffer(1, 4, 5, 2),
+    "single_pixel": random_buffer(500, 1, 1, 3),
+    "single_pixel_frame": np.ones((1, 1, 1), np.dtype("uint8")),
+    "stack_size": np.zeros((ITEM_STACK_SIZE * 2, 2, 2), np.dtype("uint8"))
+}
+
+
+
+
+@pytest.fixture(params=sorted(BUFFERS))
+def video_buf(request):
+    return BUFFERS[request.param]
+
+
+
+def test_find_runs(video_buf):
+    frames, y_res, x_res = video_buf.shape
+    run_pixels, colors, lengths = find_runs(video_buf)
+
+    # The runs of each pixel cover all the frames with alternating colors
+    runs = group_items(run_pixels, colors, lengths, x_res * y_res)
+    for pixel, pixel_runs in enumerate(runs):
+        x, y = divmod(pixel, y_res)
+
+        assert sum(length for _, length in pixel_runs) == frames
+        assert np.array_equal(
+            np.repeat([color for color, _ in pixel_runs], [length for _, length in pixel_runs]),
+            video_buf[:, y, x]
+        )
+
+
+
+def test_encode_runs(video_buf):
+    frames, y_res, x_res = video_buf.shape
+
+    items = group_items(*encode_runs(video_buf), x_res * y_res)
+    assert items == reference_items(video_buf)
+
+
+
+def test_split_runs(video_buf):
+    frames, y_res, x_res = video_buf.shape
+
+    items = group_items(*split_runs(*find_runs(video_buf)), x_res * y_res)
+    assert items == reference_items(video_buf)
+
+
+
+def test_run_tracker(video_buf):
+    frames, y_res, x_res = video_buf.shape
+
+    tracker = RunTracker(video_buf[0])
+    for frame in video_buf[1:]:
+        tracker.push(frame)
+
+    items = group_items(*tracker.finish(), x_res * y_res)
+    assert items == reference_items(video_buf)
+
+
+
+def test_change_index(video_buf):
+    frames, y_res, x_res = video_buf.shape
+
+    # Both constructors build the same runs as the whole buffer search
+    for index in [ChangeIndex.from_buffer(video_buf), ChangeIndex.from_frames(iter(video_buf))]:
+        assert index.frames == frames
+
+        for expected, value in zip(find_runs(video_buf), index.runs()):
+            assert np.array_equal(expected, value)
+
+        items = group_items(*split_runs(*index.runs()), x_res * y_res)
+        assert items == reference_items(video_buf)
+
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1000])
+def test_count_chunk_items(video_buf, chunk_size):
+    chunks = (video_buf[i:i + chunk_size] for i in range(0, len(video_buf), chunk_size))
+
+    expected = [len(pixel_items) for pixel_items in reference_items(video_buf)]
+    assert count_chunk_items(chunks).tolist() == expected
+    assert count_pixel_items(video_buf).tolist() == expected
+
+
+
+def test_plan_segments():
+    video_buf = toggle_buffer(2000, 2, 3)
+    segments = plan_segments(len(video_buf), lambda start, end: count_pixel_items(video_buf[start:end]))
+
+    # The segments cover the video and are the longest that fit
+    assert segments[0][0] == 0 and segments[-1][1] == len(video_buf)
+    for (start, end), (next_start, _) in zip(segments, segments[1:]):
+        assert end == next_start
+        assert count_pixel_items(video_buf[start:end]).max() <= MAX_BARREL_ITEMS
+        assert count_pixel_items(video_buf[start:end + 1]).max() > MAX_BARREL_ITEMS
+
+
+
+def test_change_index_range(video_buf):
+    frames = len(video_buf)
+    index = ChangeIndex.from_buffer(video_buf)
+
+    for start, end in [(0, frames), (0, 1), (frames // 3, frames), (frames // 4, frames // 2 + 1)]:
+        if start >= end:
+            continue
+
+        for expected, value in zip(find_runs(video_buf[start:end]), index.runs(start, end)):
+            assert np.array_equal(expected, value)
+
+
+
+@pytest.mark.parametrize("x_res, y_res", [(48, 27), (27, 48), (5, 1), (1, 5)])
+def test_item_buffer_non_square(x_res, y_res):
+    video_buf = random_buffer(150, y_res, x_res, x_res)
+
+    items_buffer = ItemBuffer(SimpleNamespace(x_resoulution=x_res, y_resoulution=y_res))
+    items_buffer.set_items(*encode_runs(video_buf))
+
+    # Each pixel list decodes back to the frames of that pixel
+    for x in range(0, x_res):
+        for y in range(0, y_res):
+            items = items_buffer.get_pixel_list(x, y)
+            frames = np.repeat(items >> ITEM_COLOR_SHIFT, items & ITEM_COUNT_MASK)
+
+            assert np.array_equal(frames, video_buf[:, y, x])
+
+
+
+def template_command(coordinates, items):
+    """Fill the command templates one item and one shulker at a time"""
+    shulkers = []
+
+    for b_slot, start in enumerate(range(0, len(items) + 1, SHULKER_SLOTS)):
+        item_cmds = [
+            ITEM_CMD.replace("#item_slot", str(s_slot))
+            .replace("#item_Id", ITEM_ID_DICT[item >> ITEM_COLOR_SHIFT])
+            .replace("#count", str(item & ITEM_COUNT_MASK))
+            for s_slot, item in enumerate(items[start:start + SHULKER_SLOTS])
+        ]
+
+        shulkers.append(
+            SHULKER_CMD.replace("#shulker_slot", str(b_slot)).replace("#shulker_item", ",".join(item_cmds))
+        )
+
+    return BARREL_CMD.replace("#cord", coordinates.format()).replace("#barrel_item", ",".join(shulkers))
+
+
+
+@pytest.mark.parametrize("count", [0, 1, SHULKER_SLOTS - 1, SHULKER_SLOTS, SHULKER_SLOTS + 1, 500, MAX_BARREL_ITEMS])
+def test_barrel_command(count):
+    rng = np.random.default_rng(count)
+    items = (
+        (rng.integers(0, 2, count) << ITEM_COLOR_SHIFT) | rng.integers(1, ITEM_STACK_SIZE + 1, count)
+    ).astype(np.dtype("uint8")).tobytes()
+
+    coordinates = Coordinates(-623, 223, -99)
+    assert barrel_command(coordinates, items) == template_command(coordinates, items)
+
+    with pytest.raises(Exception):
+        barrel_command(coordinates, bytes(MAX_BARREL_ITEMS + 1))
@@ -0,0 +1,95 @@
+import os
+
+import numpy as np
+import pytest
+
+from change_index import ChangeIndex
+from estimator import estimate, sampled_items
+from function_writer import FunctionWriter
+from minecraft_classes import MAX_BARREL_ITEMS
+from minecraft_encoder import MCencoder, count_pixel_items
+from video_processing import MCBuffer
+from conftest import random_frames, write_video
+
+
+
+
+def run_outputs(config):
+    """Estimate then save the output of a config, return the report and the written bytes"""
+    buf = MCBuffer(config)
+    report = estimate(buf, config)
+
+    with FunctionWriter(config) as writer:
+        MCencoder(buf, config).save_mc_function(writer)
+
+    return report, writer.written_bytes
+
+
+
+
+@pytest.mark.parametrize("step, offset, frames", [
+    (1, 0, None), (1, 0, 50), (2, 0, None), (2, 1, None), (3, 2, 97), (7, 4, None), (64, 10, None)
+])
+def test_sampled_items(step, offset, frames):
+    video_buf = random_frames(300, 5, 4, step, hold=0.6)
+    index = ChangeIndex.from_buffer(video_buf)
+
+    end = len(video_buf) if frames is None else frames
+    expected = count_pixel_items(video_buf[offset:end:step])
+
+    assert np.array_equal(sampled_items(index, step, offset, frames), expected)
+
+
+
+@pytest.mark.parametrize("minecraft_output", [
+    {},
+    {"shard_max_commands": "10"},
+    {"shard_max_bytes": "20000", "shard_dedup_kill": "False"}
+])
+def test_estimate_bytes(video_path, make_config, minecraft_output):
+    config = make_config(video_path, {"minecraft_output": minecraft_output})
+    report, written = run_outputs(config)
+
+    assert report["fits"]
+    assert report["function_bytes"] == written
+    assert report["functions"] == len(os.listdir(config.functions_path))
+
+
+
+def test_estimate_segments_bytes(tmp_path, make_config):
+    # Pixels changing on every other frame need several segments
+    video = write_video(tmp_path / "long.avi", random_frames(2500, 3, 4, 1, hold=0.0))
+    config = make_config(video, {
+        "output_screen": {"x_resoulution": "4", "y_resoulution": "3"},
+        "minecraft_output": {"temporal_segmentation": "True", "shard_max_commands": "5"}
+    })
+
+    report, written = run_outputs(config)
+
+    assert report["segments"] > 1
+    assert report["fits"]
+    assert report["function_bytes"] == written
+    assert report["functions"] == len(os.listdir(config.functions_path))
+
+
+
+def test_estimate_suggestion(tmp_path, make_config):
+    video = write_video(tmp_path / "long.avi", random_frames(2500, 3, 4, 2, hold=0.0))
+    overrides = {"output_screen": {"x_resoulution": "4", "y_resoulution": "3"}}
+
+    config = make_config(video, overrides)
+    report = estimate(MCBuffer(config), config)
+    assert not report["fits"]
+
+    def worst_items(output_screen):
+        config = make_config(video, {"output_screen": {**overrides["output_screen"], **output_screen}})
+        return count_pixel_items(MCBuffer(config).video_buf).max()
+
+    # The suggested finish frame is the last one that fits
+    finish_frame = report["suggested_finish_frame"]
+    assert worst_items({"finish_frame": str(finish_frame)}) <= MAX_BARREL_ITEMS
+    assert worst_items({"finish_frame": str(finish_frame + 1)}) > MAX_BARREL_ITEMS
+
+    # The suggested fps scaling fits the whole video
+    scaling = report["suggested_output_fps_scaling"]
+    assert worst_items({"output_fps_scaling": str(scaling)}) <= MAX_BARREL_ITEMS
@@ -0,0 +1,101 @@
+import os
+
+import numpy as np
+import pytest
+
+from video_processing import MCBuffer, read_packed_header, PACKED_HEADER_SIZE, PACKED_VERSION
+
+
+
+
+@pytest.fixture
+def packed_path(tmp_path):
+    return str(tmp_path / "video.rvpk")
+
+
+
+@pytest.fixture
+def packed_buffer(video_path, make_config, packed_path):
+    """Video loaded in RAM and saved to the packed video file"""
+    return MCBuffer(make_config(video_path, {"processing": {"packed_video_path": packed_path}}))
+
+
+
+
+def test_packed_round_trip(packed_buffer, packed_path, video_frames, make_config, video_path):
+    frames, y_res, x_res = video_frames.shape
+    assert x_res % 8 != 0
+    assert np.array_equal(packed_buffer.video_buf, video_frames)
+
+    # Header and one bit per pixel, each row padded to a byte
+    header = read_packed_header(packed_path)
+    assert [header["x_res"], header["y_res"], header["frames"]] == [x_res, y_res, frames]
+    assert header["source_hash"] == packed_buffer.source_hash
+    assert os.path.getsize(packed_path) == PACKED_HEADER_SIZE + (frames * y_res * ((x_res + 7) // 8))
+
+    # The frames are trimmed to the screen width
+    packed = MCBuffer.open_packed(packed_buffer.config, packed_path)
+    assert packed.video_buf is None
+    assert np.array_equal(np.stack(list(packed.frames())), video_frames)
+    assert np.array_equal(np.concatenate(list(packed.packed_chunks(5, 100, 7))), video_frames[5:100])
+
+    # A streaming run reads the frames from the packed video
+    config = make_config(video_path, {"processing": {"packed_video_path": packed_path, "streaming": "True"}})
+    streamed = MCBuffer(config)
+    assert streamed.packed is not None
+    assert np.array_equal(np.stack(list(streamed.frames())), video_frames)
+
+
+
+@pytest.mark.parametrize("section, key, value", [
+    ("output_screen", "x_resoulution", "13"),
+    ("output_screen", "y_resoulution", "8"),
+    ("output_screen", "output_fps_scaling", "2"),
+    ("output_screen", "start_frame", "3"),
+    ("output_screen", "finish_frame", "100"),
+    ("temporal_filter", "threshold_margin", "5"),
+    ("temporal_filter", "hold_frames", "2")
+])
+def test_packed_matches_settings(packed_buffer, packed_path, make_config, video_path, section, key, value):
+    def probe(overrides):
+        buf = MCBuffer(make_config(video_path, overrides))
+        buf.source_hash = packed_buffer.source_hash
+        return buf
+
+    assert probe({}).packed_matches(packed_path)
+    assert not probe({section: {key: value}}).packed_matches(packed_path)
+
+
+
+def test_packed_matches_source(packed_buffer, packed_path):
+    assert packed_buffer.packed_matches(packed_path)
+
+    packed_buffer.input_backend = "ffmpeg"
+    assert not packed_buffer.packed_matches(packed_path)
+
+    packed_buffer.input_backend = "opencv"
+    packed_buffer.source_hash = "0" * len(packed_buffer.source_hash)
+    assert not packed_buffer.packed_matches(packed_path)
+
+
+
+@pytest.mark.parametrize("offset, value", [(0, b"XXXX"), (4, (PACKED_VERSION + 1).to_bytes(2, "little"))])
+def test_packed_header_check(packed_buffer, packed_path, offset, value):
+    with open(packed_path, "r+b") as f:
+        f.seek(offset)
+        f.write(value)
+
+    with pytest.raises(ValueError):
+        read_packed_header(packed_path)
+
+    assert not packed_buffer.packed_matches(packed_path)
+
+
+
+@pytest.mark.parametrize("key, value", [("threshold_margin", "-1"), ("hold_frames", "0")])
+def test_filter_settings_check(make_config, video_path, capsys, key, value):
+    # The packed video header can't store them
+    with pytest.raises(SystemExit):
+        make_config(video_path, {"temporal_filter": {key: value}})
+
+    assert "temporal filter parsing failed" in capsys.readouterr().out
@@ -0,0 +1,51 @@
+import pytest
+
+from minecraft_encoder import MCencoder
+from video_processing import MCBuffer
+import instrumentation
+import pipeline
+
+
+
+
+@pytest.fixture
+def restore_quiet():
+    quiet = instrumentation.active.quiet
+    yield
+    instrumentation.active.quiet = quiet
+
+
+
+
+@pytest.mark.parametrize("quiet", [True, False])
+def test_run_keeps_quiet(make_config, video_path, restore_quiet, quiet):
+    config = make_config(video_path, {
+        "processing": {"streaming": "True", "pipelined": "True"},
+        "output_files": {"generate_debug_video": "True"}
+    })
+    buf = MCBuffer(config)
+    encoder = MCencoder(buf, config)
+
+    instrumentation.active.quiet = quiet
+    pipeline.run(buf, encoder, config)
+
+    assert instrumentation.active.quiet == quiet
+    assert encoder.encoded
+
+
+
+def test_run_keeps_quiet_on_error(make_config, video_path, restore_quiet):
+    config = make_config(video_path, {"processing": {"streaming": "True", "pipelined": "True"}})
+    buf = MCBuffer(config)
+    encoder = MCencoder(buf, config)
+
+    def fail(frames):
+        raise ValueError("stage failed")
+
+    encoder.encode = fail
+
+    instrumentation.active.quiet = True
+    with pytest.raises(ValueError):
+        pipeline.run(buf, encoder, config)
+
+    assert instrumentation.active.quiet
@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+from minecraft_classes import KILL_ITEMS_CMD
+from minecraft_encoder import MCencoder
+from video_processing import MCBuffer
+
+
+
+
+def save_function(make_config, video_path, functions_path, minecraft_output):
+    """Save the function of the test video in functions_path, return the config"""
+    os.makedirs(functions_path, exist_ok=True)
+
+    config = make_config(video_path, {
+        "minecraft_output": {"functions_path": str(functions_path), **minecraft_output}
+    })
+    MCencoder(MCBuffer(config), config).save_mc_function()
+
+    return config
+
+
+
+def read_function(path):
+    """Return the commands of a function file and if it ends with the kill command"""
+    with open(path, "r", encoding="utf8") as f:
+        text = f.read()
+
+    kill = text.endswith(KILL_ITEMS_CMD)
+    if kill:
+        text = text[:-len(KILL_ITEMS_CMD)]
+
+    assert KILL_ITEMS_CMD not in text
+    return text.splitlines(keepends=True), kill
+
+
+
+
+@pytest.mark.parametrize("max_commands, max_bytes, dedup_kill", [
+    (7, 0, True),
+    (1, 0, False),
+    (0, 5000, True),
+    (0, 5000, False),
+    (20, 3000, True),
+    (0, 1, True)
+])
+def test_shards(tmp_path, make_config, video_path, max_commands, max_bytes, dedup_kill):
+    # Single file reference
+    config = save_function(make_config, video_path, tmp_path / "single", {})
+    expected, kill = read_function(config.function_file_path)
+    assert kill
+
+    config = save_function(make_config, video_path, tmp_path / "shards", {
+        "shard_max_commands": str(max_commands),
+        "shard_max_bytes": str(max_bytes),
+        "shard_dedup_kill": str(dedup_kill)
+    })
+
+    # The driver runs the first shard and schedules the next ones in order
+    driver, kill = read_function(config.function_file_path)
+    assert not kill
+
+    shard_count = len(driver)
+    assert driver[0] == "function prog:prog_0\n"
+    assert driver[1:] == [f"schedule function prog:prog_{i} {i}t\n" for i in range(1, shard_count)]
+    assert len(os.listdir(config.functions_path)) == shard_count + 1
+
+    commands, kills = [], []
+    for i in range(0, shard_count):
+        shard, kill = read_function(os.path.join(config.functions_path, f"prog_{i}.mcfunction"))
+
+        # Each shard respects its limits, a command larger than the byte limit is alone
+        assert len(shard) > 0
+        if max_commands > 0:
+            assert len(shard) <= max_commands
+        if max_bytes > 0:
+            assert len(shard) == 1 or sum(len(command) for command in shard) <= max_bytes
+
+        commands += shard
+        kills.append(kill)
+
+    # The shards hold the single file commands
+    assert commands == expected
+
+    # The items are killed after the last shard only or after each of them
+    if dedup_kill:
+        assert kills == ([False] * (shard_count - 1)) + [True]
+    else:
+        assert all(kills)
@@ -0,0 +1,212 @@
+import os
+import re
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import nbt
+from minecraft_classes import Coordinates, BarrelLayour, barrel_body, barrel_items_nbt
+from minecraft_classes import ITEM_STACK_SIZE, ITEM_COLOR_SHIFT, SHULKER_SLOTS, MAX_BARREL_ITEMS
+from minecraft_classes import STRUCTURE_MAX_SIZE, STRUCTURE_DATA_VERSION, BARREL_STATE
+from minecraft_encoder import ItemBuffer, MCencoder, render_structures
+from video_processing import MCBuffer
+
+
+# Barrel contents of the setblock commands
+SHULKER_PATTERN = re.compile(
+    r"\{Slot:(\d+),id:white_shulker_box,Count:1,tag:\{BlockEntityTag:\{Items:\[(.*?)\]\}\}\}"
+)
+ITEM_PATTERN = re.compile(r"\{Slot:(\d+),id:([a-z_]+),Count:(\d+)\}")
+
+# Number of items of the synthetic pixels, around the shulker boundaries and the barrel capacity
+ITEM_COUNTS = [1, 2, SHULKER_SLOTS - 1, SHULKER_SLOTS, SHULKER_SLOTS + 1, 100, MAX_BARREL_ITEMS]
+
+
+
+
+def command_items(body):
+    """Return the (slot, items) of each shulker of a barrel command, the items as (slot, id, count)"""
+    return [
+        (int(slot), [(int(s), item_id, int(count)) for s, item_id, count in ITEM_PATTERN.findall(items)])
+        for slot, items in SHULKER_PATTERN.findall(body)
+    ]
+
+
+
+def nbt_items(items):
+    """Return the (slot, items) of each shulker of a barrel Items list, as command_items"""
+    shulkers = []
+
+    for shulker in items:
+        assert shulker["id"] == "minecraft:white_shulker_box"
+        assert shulker["Count"] == 1 and isinstance(shulker["Count"], nbt.Byte)
+
+        shulker_items = []
+        for item in shulker["tag"]["BlockEntityTag"]["Items"]:
+            assert isinstance(item["Slot"], nbt.Byte) and isinstance(item["Count"], nbt.Byte)
+            shulker_items.append((item["Slot"], item["id"].removeprefix("minecraft:"), item["Count"]))
+
+        shulkers.append((shulker["Slot"], shulker_items))
+
+    return shulkers
+
+
+
+def random_items(count, rng):
+    """Return count random packed items"""
+    colors = rng.integers(0, 2, count)
+    counts = rng.integers(1, ITEM_STACK_SIZE + 1, count)
+    return ((colors << ITEM_COLOR_SHIFT) | counts).astype(np.dtype("uint8"))
+
+
+
+def synthetic_buffer(x_res, y_res, seed):
+    """Items buffer with every item count of ITEM_COUNTS and some pixels sharing their items"""
+    rng = np.random.default_rng(seed)
+    shared = random_items(5, rng)
+
+    pixels = []
+    for pixel in range(0, x_res * y_res):
+        if pixel % 4 == 3:
+            pixels.append(shared)
+        else:
+            pixels.append(random_items(ITEM_COUNTS[pixel % len(ITEM_COUNTS)], rng))
+
+    items_buffer = ItemBuffer(SimpleNamespace(x_resoulution=x_res, y_resoulution=y_res))
+    items_buffer.items = np.concatenate(pixels)
+    np.cumsum([len(pixel_items) for pixel_items in pixels], out=items_buffer.offsets[1:])
+
+    return items_buffer
+
+
+
+
+@pytest.mark.parametrize("x_res, y_res, row_offset, column_offset", [
+    (3, 2, -4, 4),
+    (15, 20, -4, 4),
+    (13, 1, 1, -5)
+])
+def test_render_structures(x_res, y_res, row_offset, column_offset):
+    layout = BarrelLayour(Coordinates(-623, 223, -99), row_offset, column_offset)
+    items_buffer = synthetic_buffer(x_res, y_res, x_res * y_res)
+    items, offsets = items_buffer.items, items_buffer.offsets
+
+    # Pixel of each barrel position
+    positions = {}
+    for x in range(0, x_res):
+        for y in range(0, y_res):
+            coordinates = layout.pixel_to_ingame(x, y)
+            positions[(coordinates.X, coordinates.Y, coordinates.Z)] = items_buffer.pixel_index(x, y)
+
+    placed = set()
+    for origin, root in render_structures(items, offsets, layout, x_res, y_res):
+        # The structure file holds the same compound
+        name, loaded = nbt.loads(nbt.dumps(root))
+        assert name == ""
+
+        assert loaded["DataVersion"] == STRUCTURE_DATA_VERSION
+        assert loaded["palette"] == [BARREL_STATE]
+        assert loaded["entities"] == []
+        assert all(1 <= side <= STRUCTURE_MAX_SIZE for side in loaded["size"])
+
+        for block in loaded["blocks"]:
+            assert block["state"] == 0
+            assert all(0 <= block["pos"][axis] < loaded["size"][axis] for axis in range(0, 3))
+
+            position = (origin.X + block["pos"][0], origin.Y + block["pos"][1], origin.Z + block["pos"][2])
+            assert position not in placed
+            placed.add(position)
+
+            # Same barrel content as the setblock command
+            pixel = positions[position]
+            pixel_items = items[offsets[pixel]:offsets[pixel + 1]].tobytes()
+
+            assert block["nbt"]["id"] == "minecraft:barrel"
+            assert nbt_items(block["nbt"]["Items"]) == command_items(barrel_body(pixel_items))
+
+    assert placed == set(positions)
+
+
+
+def test_save_structures(make_config, video_path):
+    # Barrels spread over several structure cubes
+    config = make_config(video_path, {
+        "minecraft_output": {"output_format": "structure"},
+        "screen_property": {"next_row_offset": "-10", "next_column_offset": "6"}
+    })
+
+    encoder = MCencoder(MCBuffer(config), config)
+    encoder.save_mc_function()
+
+    structures = render_structures(
+        encoder.items_buffer.items,
+        encoder.items_buffer.offsets,
+        config.barrel_layout,
+        config.x_resoulution,
+        config.y_resoulution
+    )
+    assert len(structures) > 1
+
+    with open(config.function_file_path, "r", encoding="utf8") as f:
+        lines = f.read().splitlines()
+
+    # Each command places a saved structure at its origin
+    assert len(lines) == len(structures)
+    assert len(os.listdir(config.structures_path)) == len(structures)
+
+    for line, (origin, root) in zip(lines, structures):
+        words = line.split(" ")
+        assert words[:2] == ["place", "template"]
+        assert " ".join(words[3:]) == origin.format()
+
+        namespace, name = words[2].split(":")
+        assert namespace == config.function_namespace
+
+        path = os.path.join(config.structures_path, name + ".nbt")
+        assert os.path.isfile(path)
+        assert nbt.load(path) == nbt.loads(nbt.dumps(root))
+
+
+
+def test_barrel_items_nbt():
+    rng = np.random.default_rng(0)
+
+    for count in ITEM_COUNTS:
+        pixel_items = random_items(count, rng).tobytes()
+
+        raw = barrel_items_nbt(pixel_items)
+        _, loaded = nbt.loads(nbt.dumps({"Items": raw}))
+
+        # The last shulker is always added even if empty
+        assert len(loaded["Items"]) == (count // SHULKER_SLOTS) + 1
+        assert nbt_items(loaded["Items"]) == command_items(barrel_body(pixel_items))
+
+    with pytest.raises(Exception):
+        barrel_items_nbt(random_items(MAX_BARREL_ITEMS + 1, rng).tobytes())
+
+
+
+def test_nbt_round_trip():
+    root = {
+        "byte": nbt.Byte(-3),
+        "short": nbt.Short(1000),
+        "int": 123456,
+        "long": nbt.Long(2**40),
+        "float": nbt.Float(0.5),
+        "double": 0.25,
+        "string": "barrel é",
+        "bytes": nbt.ByteArray(b"\x00\x01\xff"),
+        "ints": nbt.IntArray([1, -2, 3]),
+        "longs": nbt.LongArray([2**40, -1]),
+        "list": [nbt.Int(1), nbt.Int(2)],
+        "empty": [],
+        "compound": {"nested": {"value": nbt.Byte(1)}}
+    }
+
+    name, loaded = nbt.loads(nbt.dumps(root, "root"))
+    assert name == "root"
+    assert loaded == root
+
+    for key, value in root.items():
+        assert nbt.tag_type(loaded[key]) == nbt.tag_type(value)
@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+
+from temporal_filter import THRESHOLD, threshold, count_runs, hysteresis, debounce, filter_video
+from video_processing import process_frame
+
+
+
+
+def pixel(values):
+    """Video buffer of a single pixel with the given values"""
+    return np.array(values, np.dtype("uint8")).reshape(-1, 1, 1)
+
+
+
+def pixel_runs(sequence):
+    """Return the length of each run of a pixel sequence"""
+    lengths = []
+
+    for i, value in enumerate(sequence):
+        if i > 0 and value == sequence[i - 1]:
+            lengths[-1] += 1
+        else:
+            lengths.append(1)
+
+    return lengths
+
+
+
+
+def test_hysteresis():
+    margin = 10
+    gray = pixel([
+        100,
+        THRESHOLD + 3,           # close to the threshold, stays black
+        THRESHOLD + margin,      # not past the margin, stays black
+        THRESHOLD + margin + 1,  # past the margin, flips to white
+        THRESHOLD - 7,           # close to the threshold, stays white
+        THRESHOLD,               # still within the margin, stays white
+        THRESHOLD - margin,      # past the margin, flips to black
+        THRESHOLD + 5,
+        200
+    ])
+
+    assert hysteresis(gray, margin).ravel().tolist() == [0, 0, 0, 1, 1, 1, 0, 0, 1]
+
+    # Without margin it is a fixed threshold
+    assert np.array_equal(hysteresis(gray, 0), threshold(gray))
+
+
+
+def test_hysteresis_first_frame():
+    # The first frame is thresholded even when it is within the margin
+    gray = pixel([THRESHOLD + 1, THRESHOLD - 1, THRESHOLD + 2])
+    assert hysteresis(gray, 20).ravel().tolist() == [1, 1, 1]
+
+
+
+def test_debounce():
+    video_buf = pixel([0, 0, 0, 1, 0, 0, 0, 1, 1, 1, 0, 0, 1, 1, 0, 0, 0, 0])
+
+    # The flips shorter than hold_frames are dropped
+    assert debounce(video_buf, 3).ravel().tolist() == [0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0]
+
+    # hold_frames = 1 keeps every flip
+    assert np.array_equal(debounce(video_buf, 1), video_buf)
+
+
+
+@pytest.mark.parametrize("hold_frames", [2, 3, 5, 9])
+def test_debounce_run_lengths(hold_frames):
+    rng = np.random.default_rng(hold_frames)
+    video_buf = rng.integers(0, 2, (200, 3, 4), np.dtype("uint8"))
+
+    filtered = debounce(video_buf, hold_frames)
+
+    # Every run between the first and the last one of each pixel is long enough
+    for y in range(0, 3):
+        for x in range(0, 4):
+            lengths = pixel_runs(filtered[:, y, x].tolist())
+            assert all(length >= hold_frames for length in lengths[1:-1])
+
+
+
+def test_filter_video_runs_saved():
+    margin = 10
+    gray = np.zeros((8, 1, 2), np.dtype("uint8"))
+
+    # Flickering pixel: 6 runs with a fixed threshold, 2 with the margin
+    gray[:, 0, 0] = [100, 130, 100, 130, 100, 200, 200, 200]
+    # Constant pixel: 1 run
+    gray[:, 0, 1] = 50
+
+    video_buf, runs_saved = filter_video(gray, margin, 1)
+    assert video_buf[:, 0, 0].tolist() == [0, 0, 0, 0, 0, 1, 1, 1]
+    assert runs_saved == 4
+    assert runs_saved == count_runs(threshold(gray)) - count_runs(video_buf)
+
+    # The last run is shorter than hold_frames too
+    video_buf, runs_saved = filter_video(gray, margin, 4)
+    assert video_buf[:, 0, 0].tolist() == [0] * 8
+    assert runs_saved == 5
+
+
+
+def test_filter_video_disabled():
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 256, (20, 9, 13, 3), np.dtype("uint8"))
+    out_res = (13, 9)
+
+    gray_buf = np.stack([process_frame(frame, out_res, False) for frame in frames])
+    expected = np.stack([process_frame(frame, out_res) for frame in frames])
+
+    video_buf, runs_saved = filter_video(gray_buf, 0, 1)
+    assert np.array_equal(video_buf, expected)
+    assert runs_saved == 0
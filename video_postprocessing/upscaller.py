@@ -1,6 +1,14 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+import sys
+
 import numpy as np
 import cv2
 
+# Make the encoder modules importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 
 # Upscale factor settings
 UPSCALE_FACTOR = 10
@@ -13,12 +21,26 @@ VIDEOS_DICT = {
 }
 
 
-# Run upscalling for each video
-for paths in VIDEOS_DICT.items():
-    print(f"Upscaling {paths[0]}...", end="", flush=True)
 
+
+def upscale_frame(frame, factor, out=None):
+    """
+    Exact nearest neighbour integer upscaling of a frame
+    The result is written in out if given
+    """
+    return cv2.resize(
+        frame,
+        (frame.shape[1] * factor, frame.shape[0] * factor),
+        dst=out,
+        interpolation=cv2.INTER_NEAREST
+    )
+
+
+
+def upscale_video(input_path, output_path, factor=UPSCALE_FACTOR):
+    """Upscale a video file"""
     # create a video capture object
-    in_cap = cv2.VideoCapture(paths[0])
+    in_cap = cv2.VideoCapture(input_path)
 
     # Get fps and resolution
     fps = int(in_cap.get(cv2.CAP_PROP_FPS))
@@ -29,14 +51,16 @@ for paths in VIDEOS_DICT.items():
 
 
     # Create the output stream
-    # Create the stream
     out_cap = cv2.VideoWriter(
-        paths[1],
+        output_path,
         cv2.VideoWriter_fourcc('M','J','P','G'),
         fps,
-        (res[0] * UPSCALE_FACTOR, res[1] * UPSCALE_FACTOR)
+        (res[0] * factor, res[1] * factor)
     )
 
+    # Reused output frame
+    out_frame = np.zeros((res[1] * factor, res[0] * factor, 3), np.dtype("uint8"))
+
 
     # Loop through all the frames
     while in_cap.isOpened():
@@ -45,15 +69,8 @@ for paths in VIDEOS_DICT.items():
 
         # Check for stream heath
         if ret:
-            # Upscale the frame
-            frame = cv2.resize(
-                frame,
-                (res[0] * UPSCALE_FACTOR, res[1] * UPSCALE_FACTOR), 
-                interpolation = cv2.INTER_AREA
-            )
-
-            # Write the frame to the output stream
-            out_cap.write(frame)
+            # Upscale the frame and write it to the output stream
+            out_cap.write(upscale_frame(frame, factor, out_frame))
 
         else:
             break
@@ -63,4 +80,107 @@ for paths in VIDEOS_DICT.items():
     in_cap.release()
     out_cap.release()
 
-    print(" Done")
+
+
+def upscale_frames(frames, fps, res, output_path, factor=UPSCALE_FACTOR):
+    """
+    Upscale a stream of processed binary frames,
+    as yielded by MCBuffer.frames(), to a video file
+    """
+    # Create the output stream
+    out_cap = cv2.VideoWriter(
+        output_path,
+        cv2.VideoWriter_fourcc('M','J','P','G'),
+        fps,
+        (res[0] * factor, res[1] * factor)
+    )
+
+    # Reused frames
+    gray_frame = np.zeros((res[1], res[0]), np.dtype("uint8"))
+    up_frame = np.zeros((res[1] * factor, res[0] * factor), np.dtype("uint8"))
+    out_frame = np.zeros((res[1] * factor, res[0] * factor, 3), np.dtype("uint8"))
+
+    for frame in frames:
+        # To color image
+        np.multiply(frame, 255, out=gray_frame)
+        upscale_frame(gray_frame, factor, up_frame)
+        cv2.cvtColor(up_frame, cv2.COLOR_GRAY2BGR, dst=out_frame)
+
+        out_cap.write(out_frame)
+
+    # Close the stream
+    out_cap.release()
+
+
+
+def upscale_packed(packed_path, output_path, factor=UPSCALE_FACTOR):
+    """Upscale a packed processed video file without decoding the source video"""
+    from video_processing import MCBuffer
+
+    buf = MCBuffer.open_packed(None, packed_path)
+    upscale_frames(buf.frames(), buf.output_fps, buf.out_res, output_path, factor)
+
+
+
+def upscale_file(input_path, output_path, factor=UPSCALE_FACTOR):
+    """Upscale a video file or a packed processed video file"""
+    from video_processing import read_packed_header
+
+    # Check for a packed video file
+    try:
+        read_packed_header(input_path)
+        is_packed = True
+    except (OSError, ValueError):
+        is_packed = False
+
+    if is_packed:
+        upscale_packed(input_path, output_path, factor)
+    else:
+        upscale_video(input_path, output_path, factor)
+
+    return output_path
+
+
+
+def upscale_files(videos, factor=UPSCALE_FACTOR, workers=None):
+    """
+    Upscale the given videos in parallel worker processes
+    videos is a dictionary of input path to output path
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for output_path in pool.map(
+            upscale_file,
+            videos.keys(),
+            videos.values(),
+            [factor] * len(videos)
+        ):
+            print(f"Upscaled {output_path}")
+
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Nearest neighbour upscaling of the debug videos"
+    )
+    parser.add_argument(
+        "paths", nargs="*",
+        help="input and output path pairs, videos or packed video files (default: VIDEOS_DICT)"
+    )
+    parser.add_argument("-f", "--factor", type=int, default=UPSCALE_FACTOR, help="upscale factor")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="worker processes")
+    args = parser.parse_args()
+
+    # Get the videos to upscale
+    if len(args.paths) == 0:
+        videos = VIDEOS_DICT
+    elif len(args.paths) % 2 == 0:
+        videos = dict(zip(args.paths[0::2], args.paths[1::2]))
+    else:
+        parser.error("the paths must be input and output pairs")
+
+    upscale_files(videos, args.factor, args.workers)
+
+
+
+if __name__ == "__main__":
+    main()
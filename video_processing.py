@@ -1,7 +1,295 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import itertools
+import os
+import queue
+import shutil
+import struct
+import subprocess
+import threading
+
 import numpy as np
 import cv2
 
 from settings import Config
+from encoding_cache import EncodingCache, hash_file
+import instrumentation
+import temporal_filter
+import change_index
+
+
+
+
+# Packed video file header
+# magic, version, x and y resolution, frames, original and output fps, fps scaling,
+# video start and end, first frame, source file hash, temporal filter settings
+PACKED_MAGIC = b"RVPK"
+PACKED_VERSION = 3
+PACKED_HEADER = struct.Struct("<4sHIIIIIIIII64sII8s")
+PACKED_HEADER_SIZE = 128
+
+# Frames unpacked at once when reading frame ranges of a packed video file
+PACKED_CHUNK_FRAMES = 256
+
+
+
+
+def read_packed_header(packed_path):
+    """Read the header of a packed video file and return it as a dictionary"""
+    with open(packed_path, "rb") as f:
+        data = f.read(PACKED_HEADER.size)
+
+    if len(data) < PACKED_HEADER.size:
+        raise ValueError("packed video header too short")
+
+    fields = PACKED_HEADER.unpack(data)
+    if fields[0] != PACKED_MAGIC or fields[1] != PACKED_VERSION:
+        raise ValueError("not a packed video file")
+
+    return {
+        "x_res": fields[2],
+        "y_res": fields[3],
+        "frames": fields[4],
+        "original_fps": fields[5],
+        "output_fps": fields[6],
+        "scaling": fields[7],
+        "video_start": fields[8],
+        "video_end": fields[9],
+        "first_frame": fields[10],
+        "source_hash": fields[11].decode("ascii"),
+        "threshold_margin": fields[12],
+        "hold_frames": fields[13],
+        "input_backend": fields[14].rstrip(b"\0").decode("ascii")
+    }
+
+
+
+def process_frame(frame, out_res, binary=True):
+    """
+    Convert a frame into a numpy array with output property
+    If binary is False the gray scale frame is returned without the threshold
+    """
+    # To gray scale
+    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+    # Resize the frame
+    new_x = out_res[0]
+    new_y = out_res[1]
+
+    frame = cv2.resize(frame, (new_x, new_y), interpolation=cv2.INTER_AREA)
+
+    if not binary:
+        return frame
+
+    # Convert the frame to a binary set of 0 and 1
+    _, frame = cv2.threshold(frame ,127,255, cv2.THRESH_BINARY)
+    frame = frame // 255
+
+    # Return the processed frame
+    return frame
+
+
+
+def seek_capture(cap, video_path, target):
+    """
+    Move the video capture to the target frame
+    Return the capture object and the index of the next frame to read
+    """
+    if target == 0:
+        return cap, 0
+
+    # Try to seek directly to the target frame
+    if cap.set(cv2.CAP_PROP_POS_FRAMES, target):
+        if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == target:
+            return cap, target
+
+    # Keyframe-accurate fallback:
+    # reopen the stream and grab the frames up to the target
+    cap.release()
+    cap = cv2.VideoCapture(video_path)
+
+    for position in range(0, target):
+        if not cap.grab():
+            return cap, position
+
+    return cap, target
+
+
+
+def input_backend(config: Config):
+    """
+    Return the decoder of the input video, "ffmpeg" or "opencv"
+    The auto backend is ffmpeg if it is found
+    """
+    backend = config.input_backend
+
+    if backend == "auto":
+        backend = "ffmpeg" if shutil.which(config.ffmpeg_path) is not None else "opencv"
+
+    if backend not in ("ffmpeg", "opencv"):
+        raise Exception(f"unknown input backend {backend}")
+
+    if backend == "ffmpeg" and shutil.which(config.ffmpeg_path) is None:
+        raise Exception(f"ffmpeg not found at {config.ffmpeg_path}")
+
+    return backend
+
+
+
+def read_frames_ffmpeg(ffmpeg_path, video_path, first_frame, video_end, scaling, out_res, seek, binary):
+    """
+    Decode the input video with an ffmpeg process and yield the processed output frames
+    ffmpeg drops the unused frames and outputs the kept ones already gray and area scaled,
+    the raw frames are read from its output pipe in a reused buffer
+    """
+    frames = -(-(video_end - first_frame) // scaling)
+    if frames <= 0:
+        return
+
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+
+    # Seek just before the first frame
+    seek_time = 0.0
+    input_args = ["-i", video_path]
+    if seek and first_frame > 0:
+        seek_time = (first_frame - 1) / fps
+        input_args = ["-ss", f"{seek_time:.6f}", "-i", video_path]
+
+    # The kept frames are selected by their index from the timestamp,
+    # ffmpeg shifts the timestamps to start from the stream start time plus the seek time
+    # so the index is the same with or without seeking
+    index = f"round((t+{seek_time:.6f})*{fps})"
+    select = f"gte({index}\\,{first_frame})*not(mod({index}\\,{scaling}))"
+
+    process = subprocess.Popen(
+        [
+            ffmpeg_path, "-v", "error", "-nostdin", *input_args,
+            "-an", "-vf", f"select={select},format=gray,scale={out_res[0]}:{out_res[1]}:flags=area",
+            "-vsync", "0", "-frames:v", str(frames),
+            "-f", "rawvideo", "-pix_fmt", "gray", "-"
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+
+    # Raw frame buffer
+    raw_frame = np.zeros((out_res[1], out_res[0]), np.dtype("uint8"))
+    raw_bytes = memoryview(raw_frame).cast("B")
+
+    try:
+        for _ in range(0, frames):
+            # Read a whole frame, stop at the end of the stream
+            read = 0
+            while read < len(raw_bytes):
+                count = process.stdout.readinto(raw_bytes[read:])
+                if not count:
+                    break
+                read += count
+
+            if read < len(raw_bytes):
+                break
+
+            # Return a new frame, the buffer is reused for the next one
+            yield temporal_filter.threshold(raw_frame) if binary else raw_frame.copy()
+
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+
+        error = process.stderr.read().decode("utf8", "replace").strip()
+        process.stderr.close()
+
+        if process.wait() not in (0, -9) and error != "":
+            raise Exception(f"ffmpeg decoding failed: {error}")
+
+
+
+def read_frames(
+    video_path, first_frame, video_end, scaling, out_res,
+    seek=True, binary=True, backend="opencv", ffmpeg_path="ffmpeg"
+):
+    """
+    Decode the input video and yield the processed output frames one by one
+    Only the frames in [first_frame, video_end) with an index multiple
+    of the scaling factor are processed
+    """
+    if backend == "ffmpeg":
+        yield from read_frames_ffmpeg(
+            ffmpeg_path, video_path, first_frame, video_end, scaling, out_res, seek, binary
+        )
+        return
+
+    # create a video capture object
+    cap = cv2.VideoCapture(video_path)
+
+    # Check video stream health
+    if cap.isOpened() == False:
+        raise Exception("Error during video file loading")
+
+    # Skip the frames before the first output frame
+    if seek:
+        cap, position = seek_capture(cap, video_path, first_frame)
+    else:
+        position = 0
+
+    for i in range(position, video_end):
+        # Only decode and convert the frames that are kept,
+        # the dropped frames are grabbed without being retrieved
+        if i >= first_frame and i % scaling == 0:
+            ret, frame = cap.read()
+        else:
+            ret, frame = cap.grab(), None
+
+        # Check the health of the steam
+        if (not ret) or (not cap.isOpened()):
+            break
+
+        # Process frame
+        if frame is not None:
+            yield process_frame(frame, out_res, binary)
+
+
+    # When everything done, release the video capture object
+    cap.release()
+
+
+
+def decode_segment(
+    video_path, shm_name, shape, segment, first_frame, video_end, scaling, seek,
+    binary=True, backend="opencv", ffmpeg_path="ffmpeg"
+):
+    """
+    Decode a segment of output frames in a worker process
+    The frames are written in the shared memory video buffer
+    Return the number of decoded frames
+    """
+    # Attach to the shared video buffer
+    shm = shared_memory.SharedMemory(name=shm_name)
+    video_buf = np.ndarray(shape, np.dtype('uint8'), buffer=shm.buf)
+
+    # Get the input frames range of the segment
+    start, end = segment
+    seg_first = first_frame + (start * scaling)
+    seg_end = min(first_frame + ((end - 1) * scaling) + 1, video_end)
+
+    buf_counter = start
+    for frame in read_frames(
+        video_path, seg_first, seg_end, scaling, (shape[2], shape[1]), seek,
+        binary, backend, ffmpeg_path
+    ):
+        video_buf[buf_counter] = frame
+        buf_counter += 1
+
+    # Detach from the shared buffer
+    del video_buf
+    shm.close()
+
+    return buf_counter - start
+
+
 
 
 class MCBuffer:
@@ -9,6 +297,8 @@ class MCBuffer:
     def __init__(self, config: Config) -> None:
         """
         Read the input video file, process it and store it in RAM as a np array
+        In streaming mode only the video property are read,
+        the frames are then decoded on demand by frames()
         """
         # Get a reference to the config object
         self.config = config
@@ -29,6 +319,9 @@ class MCBuffer:
         # Get the output resolution
         self.out_res = [config.x_resoulution, config.y_resoulution]
 
+        # Get the decoder of the frames
+        self.input_backend = input_backend(config)
+
 
         # Get video starting and ending point
         # Ending point
@@ -51,93 +344,371 @@ class MCBuffer:
 
 
         # Calculate the number of ouput frames
-        input_frames = self.video_end - self.video_start
+        # Only the frames with an index multiple of the scaling factor are kept
+        scaling = config.output_fps_scaling
+        self.first_frame = -(-self.video_start // scaling) * scaling
+        input_frames = self.video_end - self.first_frame
         # If input_frames is a multiple of the scaling factor don't add 1
-        if input_frames % config.output_fps_scaling == 0:
-            self.output_frames = input_frames // config.output_fps_scaling
+        if input_frames % scaling == 0:
+            self.output_frames = input_frames // scaling
         else:
-            self.output_frames = (input_frames // config.output_fps_scaling) + 1
+            self.output_frames = (input_frames // scaling) + 1
 
-        # Create the video buffer
-        self.video_buf = np.zeros(
-            (self.output_frames, self.out_res[1], self.out_res[0]),
-            np.dtype('uint8')
-        )
+        if self.output_frames <= 0:
+            raise Exception("no frame to process in the selected video section")
 
-        buf_counter = 0
+        # When everything done, release the video capture object
+        cap.release()
 
 
-        # Load the processed video in the buffer
-        print(f"Loading {input_video_path} to RAM... ", end="", flush=True)
-        for i in range(0, self.video_end):
-            # Capture frame-by-frame
-            ret, frame = cap.read()
+        # In streaming mode the frames are decoded on demand by frames()
+        self.video_buf = None
+        self.packed = None
+
+        # Pixel changes index, built on demand by change_index()
+        self.__change_index = None
+
+        # Get the hash of the input file
+        self.cache = None
+        self.source_hash = None
+        if config.cache_dir != "":
+            self.cache = EncodingCache(config.cache_dir)
+            self.source_hash = self.cache.source_hash(input_video_path)
+        elif config.source_hash is not None:
+            self.source_hash = config.source_hash
+        elif config.packed_video_path != "":
+            self.source_hash = hash_file(input_video_path)
+
+        # Get the cache key of the processed video
+        self.cache_key = None
+        if self.cache is not None:
+            self.cache_key = self.cache.buffer_key(self.source_hash, config.buffer_settings(self.input_backend))
+
+
+        # Open the packed video if it was saved from the same video and settings
+        packed_path = config.packed_video_path
+        if packed_path != "" and self.packed_matches(packed_path):
+            self.__open_packed(read_packed_header(packed_path), packed_path)
+            print(f"Opened packed video {packed_path}")
+            return
 
-            # check if video start is reached
-            if i >= self.video_start:
-                # Process frame
-                if i % config.output_fps_scaling == 0:
-                    self.video_buf[buf_counter] = self.__process_frame(frame)
+        if not config.streaming:
+            self.__load(input_video_path)
+        elif config.temporal_filter:
+            raise Exception("the temporal filter needs the video in RAM")
+
+        # Save the packed video for the next runs,
+        # in streaming mode the frames are then read from it
+        if packed_path != "":
+            self.save_packed(packed_path)
+
+            if self.video_buf is None:
+                self.__open_packed(read_packed_header(packed_path), packed_path)
+
+
+
+    def __load(self, input_video_path):
+        """
+        Load the processed video in the buffer,
+        from the cache if available or decoding the input video
+        """
+        # Load the processed video from the cache if available
+        if self.cache is not None:
+            self.video_buf = self.cache.load_buffer(self.cache_key)
+
+            if self.video_buf is not None:
+                self.output_frames = len(self.video_buf)
+                print(f"Loaded {input_video_path} from cache")
+                return
+
+        # Load the processed video in the buffer
+        with instrumentation.stage(
+            "decode", f"Loading {input_video_path} to RAM", total=self.output_frames
+        ) as stage:
+            workers = min(self.config.decode_workers, self.output_frames)
+            if workers > 1:
+                # Decode the video segments in parallel
+                buf_counter = self.__load_parallel(workers)
+                stage.advance(buf_counter)
+
+            else:
+                # Create the video buffer
+                self.video_buf = np.zeros(
+                    (self.output_frames, self.out_res[1], self.out_res[0]),
+                    np.dtype('uint8')
+                )
+
+                buf_counter = 0
+
+                for frame in self.__read_frames():
+                    self.video_buf[buf_counter] = frame
                     buf_counter += 1    # increment the counter
+                    stage.advance()
 
+            # Drop the unused frames if the stream ended early
+            if buf_counter < self.output_frames:
+                self.video_buf = self.video_buf[:buf_counter]
+                self.output_frames = buf_counter
 
-            # Check the health of the steam
-            if (not ret) or (not cap.isOpened()):
-                break
+        if self.output_frames == 0:
+            raise Exception("No frame decoded from the input video")
 
+        # Threshold the gray scale video removing the pixel flickers
+        if self.config.temporal_filter:
+            with instrumentation.stage(
+                "filter", "Filtering the pixel flickers", total=self.output_frames
+            ) as stage:
+                self.video_buf, runs_saved = temporal_filter.filter_video(
+                    self.video_buf, self.config.threshold_margin, self.config.hold_frames
+                )
+                stage.advance(self.output_frames)
+                stage.add("runs_saved", runs_saved)
 
-        # When everything done, release the video capture object
-        cap.release()
-        print("Done")
+            print(f"The temporal filter saved {runs_saved} pixel runs")
+
+        # Save the processed video in the cache
+        if self.cache is not None:
+            self.cache.save_buffer(self.cache_key, self.video_buf)
 
 
 
-    def __process_frame(self, frame):
-        """Convert a frame into a numpy array with output property"""
-        # To gray scale
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    @classmethod
+    def open_packed(cls, config: Config, packed_path):
+        """
+        Open a packed video file without the input video
+        The frames are read from the file on demand
+        """
+        buf = cls.__new__(cls)
+        buf.config = config
+        buf.video_buf = None
+        buf.cache = None
+        buf.cache_key = None
+        buf.__change_index = None
+
+        buf.__open_packed(read_packed_header(packed_path), packed_path)
+        return buf
+
+
+
+    def __open_packed(self, header, packed_path):
+        """Memory map a packed video file and get the video property from its header"""
+        self.out_res = [header["x_res"], header["y_res"]]
+
+        self.original_fps = header["original_fps"]
+        self.output_fps = header["output_fps"]
+
+        self.video_start = header["video_start"]
+        self.video_end = header["video_end"]
+        self.first_frame = header["first_frame"]
+        self.output_frames = header["frames"]
+        self.source_hash = header["source_hash"]
+        self.input_backend = header["input_backend"]
+
+        self.packed = np.memmap(
+            packed_path,
+            np.dtype("uint8"),
+            mode="r",
+            offset=PACKED_HEADER_SIZE,
+            shape=(self.output_frames, self.out_res[1], (self.out_res[0] + 7) // 8)
+        )
 
-        # Resize the frame
-        new_x = self.out_res[0]
-        new_y = self.out_res[1]
 
-        frame = cv2.resize(frame, (new_x, new_y), interpolation=cv2.INTER_AREA)
 
-        # Convert the frame to a binary set of 0 and 1
-        _, frame = cv2.threshold(frame ,127,255, cv2.THRESH_BINARY)
-        frame = frame // 255
+    def packed_matches(self, packed_path):
+        """Check if a packed video file was saved from the input video and settings"""
+        try:
+            header = read_packed_header(packed_path)
+        except (OSError, ValueError):
+            return False
 
-        # Return the processed frame
-        return frame
+        return (
+            header["source_hash"] == self.source_hash
+            and [header["x_res"], header["y_res"]] == self.out_res
+            and header["scaling"] == self.config.output_fps_scaling
+            and header["video_start"] == self.video_start
+            and header["video_end"] == self.video_end
+            and header["threshold_margin"] == self.config.threshold_margin
+            and header["hold_frames"] == self.config.hold_frames
+            and header["input_backend"] == self.input_backend
+        )
 
 
 
-    def generate_debug_video(self):
+    def save_packed(self, packed_path, frames=None):
         """
-        Save the processed video buffer to the input file
+        Save the processed video to a packed file
+        Each frame row is bit-packed after a header with the video property
+        The frames are read from the buffer if no frames iterable is given
         """
-        # Create the stream
-        debug_video_cap = cv2.VideoWriter(
-            self.config.debug_video_path,
-            cv2.VideoWriter_fourcc('M','J','P','G'),
-            self.output_fps,
-            (self.out_res[0], self.out_res[1])
+        if frames is None:
+            frames = self.frames()
+
+        tmp_path = packed_path + ".tmp"
+
+        with instrumentation.stage(
+            "pack", f"Saving packed video {packed_path}", total=self.output_frames
+        ) as stage, open(tmp_path, "wb") as f:
+            # Reserve the header space
+            f.write(bytes(PACKED_HEADER_SIZE))
+
+            # Write the packed frames
+            frame_count = 0
+            for frame in frames:
+                f.write(np.packbits(frame, axis=1).tobytes())
+                frame_count += 1
+                stage.advance()
+
+            # Write the header
+            f.seek(0)
+            f.write(PACKED_HEADER.pack(
+                PACKED_MAGIC,
+                PACKED_VERSION,
+                self.out_res[0],
+                self.out_res[1],
+                frame_count,
+                self.original_fps,
+                self.output_fps,
+                self.config.output_fps_scaling,
+                self.video_start,
+                self.video_end,
+                self.first_frame,
+                self.source_hash.encode("ascii"),
+                self.config.threshold_margin,
+                self.config.hold_frames,
+                self.input_backend.encode("ascii")
+            ))
+
+            stage.add("bytes", f.seek(0, os.SEEK_END))
+
+        # Don't keep an empty packed video for the next runs
+        if frame_count == 0:
+            os.remove(tmp_path)
+            raise Exception("No frame decoded from the input video")
+
+        os.replace(tmp_path, packed_path)
+
+
+
+    def __read_frames(self):
+        """
+        Decode the input video and yield the processed output frames one by one
+        """
+        return read_frames(
+            self.config.input_video_file,
+            self.first_frame,
+            self.video_end,
+            self.config.output_fps_scaling,
+            self.out_res,
+            self.config.seek_to_start,
+            not self.config.temporal_filter,
+            self.input_backend,
+            self.config.ffmpeg_path
         )
 
-        # Write the video on the stream
-        print("Generating debug video... ", end="", flush=True)
-        for i in range(0, len(self.video_buf)):
-            # To color imgage
-            frame = self.video_buf[i] * 255
-            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
 
-            # Write frame on stream
-            debug_video_cap.write(frame)
+
+    def __load_parallel(self, workers):
+        """
+        Decode the video in segments on multiple worker processes
+        The segments are written in a shared memory video buffer
+        Return the number of loaded frames
+        """
+        shape = (self.output_frames, self.out_res[1], self.out_res[0])
+
+        # Create the shared video buffer
+        self.__shm = shared_memory.SharedMemory(
+            create=True, size=max(1, int(np.prod(shape)))
+        )
+        self.video_buf = np.ndarray(shape, np.dtype('uint8'), buffer=self.__shm.buf)
+        self.video_buf[:] = 0
+
+        # Split the output frames in segments, one for each worker
+        bounds = np.linspace(0, self.output_frames, workers + 1).astype(int)
+        segments = [
+            (int(bounds[i]), int(bounds[i + 1]))
+            for i in range(0, workers) if bounds[i] < bounds[i + 1]
+        ]
+
+        try:
+            # Decode the segments
+            with ProcessPoolExecutor(max_workers=len(segments)) as pool:
+                counts = list(pool.map(
+                    decode_segment,
+                    [self.config.input_video_file] * len(segments),
+                    [self.__shm.name] * len(segments),
+                    [shape] * len(segments),
+                    segments,
+                    [self.first_frame] * len(segments),
+                    [self.video_end] * len(segments),
+                    [self.config.output_fps_scaling] * len(segments),
+                    [self.config.seek_to_start] * len(segments),
+                    [not self.config.temporal_filter] * len(segments),
+                    [self.input_backend] * len(segments),
+                    [self.config.ffmpeg_path] * len(segments)
+                ))
+
+        finally:
+            # The buffer stay mapped until the object is deleted
+            self.__shm.unlink()
+
+
+        # Stop at the first segment that ended early
+        buf_counter = 0
+        for segment, count in zip(segments, counts):
+            buf_counter += count
+
+            if count < segment[1] - segment[0]:
+                break
+
+        return buf_counter
 
 
-        # Close the stream
-        debug_video_cap.release()
-        print("Done")
+
+    def frames(self):
+        """
+        Yield the processed frames in order
+        Read them from RAM if the video is loaded, from the packed video file if opened,
+        decode them on demand otherwise
+        """
+        if self.video_buf is not None:
+            yield from self.video_buf
+
+        elif self.packed is not None:
+            # Unpack the frames from the packed video file
+            for packed_frame in self.packed:
+                yield np.unpackbits(packed_frame, axis=1, count=self.out_res[0])
+
+        else:
+            yield from self.__read_frames()
+
+
+
+    def packed_chunks(self, start, end, size=PACKED_CHUNK_FRAMES):
+        """
+        Yield the processed frames in [start, end) of the packed video file
+        in arrays of at most size frames
+        """
+        for chunk_start in range(start, end, size):
+            yield np.unpackbits(
+                self.packed[chunk_start:min(end, chunk_start + size)], axis=2, count=self.out_res[0]
+            )
+
+
+
+    def change_index(self):
+        """Return the index of the pixel changes, built on the first call"""
+        if self.__change_index is None:
+            self.__change_index = change_index.build(self)
+
+        return self.__change_index
+
+
+
+    def generate_debug_video(self):
+        """
+        Save the processed video buffer to the input file
+        """
+        self.generate_diagnostic_videos(True, False, "Generating debug video")
 
 
 
@@ -146,32 +717,271 @@ class MCBuffer:
         Generate the pixel update map for the video
         and save to the specified file
         """
+        self.generate_diagnostic_videos(False, True, "Generating update map video")
+
+
+
+    def generate_diagnostic_videos(
+        self, debug=True, update_map=True, label="Generating debug videos", frames=None
+    ):
+        """
+        Generate the debug video and the pixel update map video
+        with a single pass on the frames, by default the frames of the buffer
+        If the video is in RAM the update map is read from the change index
+        and the frames are only read for the debug video,
+        otherwise the update map is computed from the frames to keep the memory bounded
+        """
+        index = None
+        if frames is None:
+            if update_map and self.video_buf is not None:
+                index = self.change_index()
+
+            frames = self.frames() if debug or index is None else itertools.repeat(None, index.frames)
+
+        with instrumentation.stage("diagnostics", label, total=self.output_frames) as stage:
+            writer = DiagnosticWriter(
+                self.config, self.output_fps, self.out_res, debug, update_map
+            )
+
+            try:
+                for i, frame in enumerate(frames):
+                    writer.write(frame, index.frame_changes(i) if index is not None else None)
+                    stage.advance()
+
+            finally:
+                # Close the streams even if a frame failed, keeping playable videos
+                writer.release()
+
+
+
+
+class BufferView:
+    """
+    A part of a processed video, a screen of a tiled display or a frame range
+    Same interface as MCBuffer for the encoder
+    """
+    def __init__(self, buffer: MCBuffer, x_range=None, y_range=None, frame_range=None) -> None:
+        # Get the view ranges, the whole video by default
+        self.__x_range = x_range if x_range is not None else (0, buffer.out_res[0])
+        self.__y_range = y_range if y_range is not None else (0, buffer.out_res[1])
+        self.__frame_range = frame_range if frame_range is not None else (0, buffer.output_frames)
+
+        self.output_fps = buffer.output_fps
+        self.output_frames = self.__frame_range[1] - self.__frame_range[0]
+        self.out_res = [
+            self.__x_range[1] - self.__x_range[0],
+            self.__y_range[1] - self.__y_range[0]
+        ]
+
+        # Views are not cached
+        self.cache = None
+        self.cache_key = None
+        self.__change_index = None
+
+        # The source is only kept when the video is not in RAM
+        self.__source = buffer if buffer.video_buf is None else None
+
+        # Packed video file of the source, None if in RAM or decoded on demand
+        self.packed = buffer.packed if buffer.video_buf is None else None
+
+        self.video_buf = None
+        if buffer.video_buf is not None:
+            self.video_buf = self.crop(
+                buffer.video_buf[self.__frame_range[0]:self.__frame_range[1]]
+            )
+
+
+
+    def crop(self, video):
+        """Return the view part of a frame or of a video buffer"""
+        return video[
+            ..., self.__y_range[0]:self.__y_range[1], self.__x_range[0]:self.__x_range[1]
+        ]
+
+
+
+    def frames(self):
+        """Yield the processed frames of the view in order"""
+        if self.video_buf is not None:
+            yield from self.video_buf
+
+        else:
+            for i, frame in enumerate(self.__source.frames()):
+                if i >= self.__frame_range[1]:
+                    break
+
+                if i >= self.__frame_range[0]:
+                    yield self.crop(frame)
+
+
+
+    def change_index(self):
+        """Return the index of the pixel changes of the view, built on the first call"""
+        if self.__change_index is None:
+            self.__change_index = change_index.build(self)
+
+        return self.__change_index
+
+
+
+
+class VideoStreamWriter:
+    """
+    MJPG video writer fed with preallocated BGR frames
+    In background mode the frames are encoded by a separate thread
+    """
+    def __init__(self, path, fps, out_res, background, pool_size=4) -> None:
         # Create the stream
-        update_map_cap = cv2.VideoWriter(
-            self.config.update_map_video_path,
+        self.writer = cv2.VideoWriter(
+            path,
             cv2.VideoWriter_fourcc('M','J','P','G'),
-            self.output_fps,
-            (self.out_res[0], self.out_res[1])
+            fps,
+            (out_res[0], out_res[1])
         )
 
-        last_frame = self.video_buf[0]
+        self.background = background
+
+        # Preallocated output frames
+        self.free_frames = queue.Queue()
+        for _ in range(0, pool_size if background else 1):
+            self.free_frames.put(np.zeros((out_res[1], out_res[0], 3), np.dtype("uint8")))
+
+        # Start the encoding thread
+        if background:
+            self.error = None
+            self.pending_frames = queue.Queue()
+
+            self.thread = threading.Thread(target=self.__run, daemon=True)
+            self.thread.start()
+
+
+
+    def __run(self):
+        """Write the pending frames on the stream"""
+        while True:
+            frame = self.pending_frames.get()
+            if frame is None:
+                break
+
+            try:
+                if self.error is None:
+                    self.writer.write(frame)
+            except Exception as e:
+                self.error = e
+
+            # Give back the frame buffer
+            self.free_frames.put(frame)
+
+
+
+    def get_frame(self):
+        """Return a free BGR frame buffer to fill"""
+        return self.free_frames.get()
+
+
+
+    def write(self, frame):
+        """Write a frame buffer obtained from get_frame on the stream"""
+        if self.background:
+            self.pending_frames.put(frame)
+        else:
+            self.writer.write(frame)
+            self.free_frames.put(frame)
+
+
+
+    def release(self):
+        """Wait for the pending frames and close the stream"""
+        if self.background:
+            self.pending_frames.put(None)
+            self.thread.join()
+
+            if self.error is not None:
+                raise self.error
+
+        self.writer.release()
+
+
+
+
+class DiagnosticWriter:
+    """
+    Write the debug video and the pixel update map video
+    from the same frames stream, reusing the output buffers
+    """
+    def __init__(self, config: Config, fps, out_res, debug=True, update_map=True) -> None:
+        background = config.background_video_writer
+
+        self.debug_writer = None
+        if debug:
+            self.debug_writer = VideoStreamWriter(
+                config.debug_video_path, fps, out_res, background
+            )
+
+        self.update_map_writer = None
+        if update_map:
+            self.update_map_writer = VideoStreamWriter(
+                config.update_map_video_path, fps, out_res, background
+            )
+
+        # Preallocated processing buffers
+        self.gray_frame = np.zeros((out_res[1], out_res[0]), np.dtype("uint8"))
+        self.update_frame = np.zeros((out_res[1], out_res[0]), np.dtype("bool"))
+        self.last_frame = np.zeros((out_res[1], out_res[0]), np.dtype("uint8"))
+        self.first_frame = True
 
-        # Loop throug all the frame
-        print("Generating update map video... ", end="", flush=True)
-        for i in range(1, len(self.video_buf)):
-            # Produce the pixel update frame and convert it to color
-            frame = np.where(self.video_buf[i] != last_frame, 255, 0)
-            frame = frame.astype(np.dtype("uint8"))
+        # Update map in pixel index order, filled from the change events
+        self.update_columns = np.zeros((out_res[0], out_res[1]), np.dtype("uint8"))
 
-            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
 
-            update_map_cap.write(frame)
+
+    def write(self, frame, changes=None):
+        """
+        Write a processed frame on the output videos
+        If the changed pixels of the frame are given
+        the update map is drawn from them instead of the frames difference
+        """
+        if self.debug_writer is not None:
+            # To color imgage
+            np.multiply(frame, 255, out=self.gray_frame)
+
+            output = self.debug_writer.get_frame()
+            cv2.cvtColor(self.gray_frame, cv2.COLOR_GRAY2BGR, dst=output)
+
+            # Write frame on stream
+            self.debug_writer.write(output)
+
+
+        if self.update_map_writer is not None:
+            # The first frame has no update map
+            if not self.first_frame:
+                # Produce the pixel update frame and convert it to color
+                if changes is not None:
+                    self.update_columns.fill(0)
+                    self.update_columns.reshape(-1)[changes] = 255
+                    np.copyto(self.gray_frame, self.update_columns.T)
+                else:
+                    np.not_equal(frame, self.last_frame, out=self.update_frame)
+                    np.multiply(self.update_frame, 255, out=self.gray_frame, casting="unsafe")
+
+                output = self.update_map_writer.get_frame()
+                cv2.cvtColor(self.gray_frame, cv2.COLOR_GRAY2BGR, dst=output)
+
+                self.update_map_writer.write(output)
 
             # Save last frame for the next frame
-            last_frame = self.video_buf[i]
+            if changes is None:
+                np.copyto(self.last_frame, frame)
+            self.first_frame = False
+
 
 
-        # Close the stream
-        update_map_cap.release()
-        print("Done")
+    def release(self):
+        """Close the output streams, the second one even if the first fails"""
+        try:
+            if self.debug_writer is not None:
+                self.debug_writer.release()
 
+        finally:
+            if self.update_map_writer is not None:
+                self.update_map_writer.release()